@@ -1,10 +1,23 @@
+from array import array
+from bisect import bisect_left
+from itertools import compress
+
 class BoxValueError(Exception):
     """
     A Box Value Error occurs when a user tries to create a box with non-positive dimensions
     """
     pass
 
+def check_dimension(value):
+    if value <= 0:
+        raise(BoxValueError("Tried to create a box with non-positive dimensions"))
+    return value
+
 class Box:
+    # No per-instance __dict__; lo and hi cache the dimensions sorted,
+    # since that is all that comparisons ever look at.
+    __slots__ = ('_dim1', '_dim2', '_lo', '_hi')
+
     def __init__(self, dim1,dim2):
         """
         A 2-dimensional box, where dim1 is the length of the first dimension of the box and box.dim2 is the length of the second dimension. You can interpret this loosly as the width and height of the box, but we use the boxes without regard to orientation. 
@@ -31,9 +44,22 @@ class Box:
         Traceback (most recent call last):
             ...
         box.BoxValueError: Tried to create a box with non-positive dimensions
+        >>> b = Box(5,2)
+        >>> b.lo, b.hi
+        (2, 5)
+        >>> b.dim2 = 7
+        >>> b.lo, b.hi
+        (5, 7)
         """
-        self.dim1 = dim1
-        self.dim2 = dim2
+        self._dim1 = check_dimension(dim1)
+        self._dim2 = check_dimension(dim2)
+        self._normalize()
+
+    def _normalize(self):
+        if self._dim1 <= self._dim2:
+            self._lo, self._hi = self._dim1, self._dim2
+        else:
+            self._lo, self._hi = self._dim2, self._dim1
         
     @property
     def dim1(self):
@@ -42,20 +68,59 @@ class Box:
     @property
     def dim2(self):
         return self._dim2
+
+    @property
+    def lo(self):
+        """The smaller of the two dimensions"""
+        return self._lo
+
+    @property
+    def hi(self):
+        """The larger of the two dimensions"""
+        return self._hi
     
+    @property
+    def key(self):
+        """
+        Canonical identity of the box: its sorted dimensions. Boxes with
+        the same key are interchangeable for any nesting question.
+
+        >>> Box(4,2).key == Box(2,4).key
+        True
+        """
+        return self._lo, self._hi
+
+    def __eq__(self, b):
+        """
+        Boxes are equal when they have the same dimensions in either
+        orientation. A box can be resized, so it is not hashable; use its
+        key, which is, in sets and as a dict key.
+
+        >>> Box(4,2) == Box(2,4), Box(4,2) == Box(4,3)
+        (True, False)
+        >>> len({Box(4,2).key, Box(2,4).key})
+        1
+        >>> {Box(4,2)}
+        Traceback (most recent call last):
+            ...
+        TypeError: unhashable type: 'Box'
+        """
+        if not isinstance(b, Box):
+            return NotImplemented
+        return self.key == b.key
+
+    # Equal boxes would need equal hashes, and resizing would change them
+    __hash__ = None
+
     @dim1.setter
     def dim1(self,value):
-        if value <= 0:
-            raise(BoxValueError("Tried to create a box with non-positive dimensions"))
-        self._dim1 = value
+        self._dim1 = check_dimension(value)
+        self._normalize()
     
     @dim2.setter
     def dim2(self,value):
-        if value <= 0:
-            raise(BoxValueError("Tried to create a box with non-positive dimensions"))
-        self._dim2 = value
-    
-    
+        self._dim2 = check_dimension(value)
+        self._normalize()
         
     def __str__(self):
         return "({},{})".format(self.dim1, self.dim2)
@@ -79,5 +144,62 @@ class Box:
         >>> b1 < Box(6, 7)
         True
         """
-        return ((min(self.dim1, self.dim2) < min(b.dim1,b.dim2)) and
-                 (max(self.dim1,self.dim2) < max(b.dim1,b.dim2)))
+        return self._lo < b._lo and self._hi < b._hi
+
+class BoxSet:
+    """
+    An immutable collection of boxes kept sorted by smaller side (and by
+    decreasing larger side among equal smaller sides), with both sides
+    stored in flat arrays so that nesting queries run over whole columns
+    instead of comparing Box objects one pair at a time.
+
+    >>> bs = BoxSet([Box(1,3), Box(4,2), Box(1,5), Box(6,2), Box(7,4)])
+    >>> len(bs)
+    5
+    >>> [str(b) for b in bs]
+    ['(1,5)', '(1,3)', '(6,2)', '(4,2)', '(7,4)']
+    """
+    __slots__ = ('_boxes', '_los', '_his')
+
+    def __init__(self, boxes=()):
+        self._boxes = sorted(boxes, key=lambda b: (b.lo, -b.hi))
+        self._los = array('d', (b.lo for b in self._boxes))
+        self._his = array('d', (b.hi for b in self._boxes))
+
+    def __len__(self):
+        return len(self._boxes)
+
+    def __iter__(self):
+        return iter(self._boxes)
+
+    def __getitem__(self, i):
+        return self._boxes[i]
+
+    def _fitting_mask(self, box):
+        # Only the prefix with a smaller lo can fit; within it, the
+        # comparison runs over the hi column in C via map. The bound is
+        # made a float since int.__gt__(float) is NotImplemented.
+        k = bisect_left(self._los, box.lo)
+        return k, map(float(box.hi).__gt__, self._his[:k])
+
+    def fitting_in(self, box):
+        """
+        Returns the boxes that fit inside box, in collection order.
+
+        Efficiency: O(log n + k) where k boxes have a smaller lo than box.
+
+        >>> bs = BoxSet([Box(1,3), Box(4,2), Box(1,5), Box(6,2), Box(7,4)])
+        >>> [str(b) for b in bs.fitting_in(Box(5, 5))]
+        ['(1,3)', '(4,2)']
+        >>> bs.fitting_in(Box(1, 9))
+        []
+        """
+        k, mask = self._fitting_mask(box)
+        return list(compress(self._boxes[:k], mask))
+
+    def count_fitting_in(self, box):
+        """
+        >>> BoxSet([Box(1,3), Box(4,2), Box(2,2)]).count_fitting_in(Box(5,5))
+        3
+        """
+        return sum(self._fitting_mask(box)[1])
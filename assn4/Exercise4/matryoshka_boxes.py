@@ -1,4 +1,7 @@
-from box import Box
+from bisect import bisect_left
+from collections import OrderedDict
+
+from box import Box, BoxSet
 
 def largest_box_subset(baby_boxes, mama_box, memo = None):
     """ 
@@ -41,7 +44,10 @@ def largest_box_subset(baby_boxes, mama_box, memo = None):
     stacked into
     memo (dictionary): An optional arguement. A dictionary for storing 
     already solved subproblems of the largest_box_subset function. Assumed to
-    map from problem instances to correct solutions.
+    map from problem instances to correct solutions. Problem instances are
+    keyed by (box_set_key(baby_boxes), mama_box.key), so a memo (for
+    instance a BoundedMemo) can be shared across calls and every subproblem
+    solved along the way is stored too.
         
     >>> b = (Box(1,3), Box(4,2), Box(1,5), Box(6,2), Box(7,4),Box(2,6))
     >>> largest_box_subset(b,Box(8,8))
@@ -58,6 +64,37 @@ def largest_box_subset(baby_boxes, mama_box, memo = None):
     3
     >>> largest_box_subset((Box(3,3), Box(1,1)), Box(2,2))
     2
+    >>> largest_box_subset((), Box(2,2))
+    1
+
+    The answers agree with the plain recursive definition:
+
+    >>> import random
+    >>> rng = random.Random(275)
+    >>> for _ in range(200):
+    ...     b = tuple(Box(rng.randint(1, 9), rng.randint(1, 9))
+    ...               for _ in range(rng.randint(0, 12)))
+    ...     mama = Box(rng.randint(1, 10), rng.randint(1, 10))
+    ...     assert (largest_box_subset(b, mama) ==
+    ...             largest_box_subset_recursive(b, mama))
+
+    A shared memo answers repeated and overlapping questions, even
+    when asked with different but equal Box objects:
+
+    >>> memo = BoundedMemo()
+    >>> b = (Box(1,3), Box(4,2), Box(1,5), Box(6,2), Box(7,4),Box(2,6))
+    >>> largest_box_subset(b, Box(8,8), memo)
+    4
+    >>> largest_box_subset(tuple(reversed(b)), Box(7,4), memo)
+    3
+    >>> memo.hits, memo.misses
+    (1, 1)
+
+    Thousands of boxes are no problem for the recursion limit:
+
+    >>> b = tuple(Box(i, i + 1) for i in range(1, 5001))
+    >>> largest_box_subset(b, Box(10**4, 10**4))
+    5001
     """
     # fill in your definition of largest_box_subset here. Feel free to write
     # any auxillary functions you feel will help you/make your code cleaner.
@@ -70,4 +107,286 @@ def largest_box_subset(baby_boxes, mama_box, memo = None):
     if memo is None:
         memo = {}
 
-    
+    set_key = box_set_key(baby_boxes)
+    key = (set_key, mama_box.key)
+    answer = memo.get(key)
+    if answer is None:
+        if not isinstance(baby_boxes, BoxSet):
+            baby_boxes = BoxSet(baby_boxes)
+        candidates = baby_boxes.fitting_in(mama_box)
+        length, _ = nesting_lengths(candidates)
+
+        # Each candidate is itself a subproblem: the longest chain ending
+        # at it, counting it, is the answer with it as the mama box.
+        for box, n in zip(candidates, length):
+            memo[(set_key, box.key)] = n
+
+        # The mama box itself adds 1 to the longest chain inside it
+        answer = 1 + max(length, default=0)
+        memo[key] = answer
+
+    return answer
+
+def box_set_key(baby_boxes):
+    """
+    Canonical, hashable identity of a set of boxes. Duplicates never
+    nest inside each other, so only the distinct dimensions matter.
+
+    >>> box_set_key([Box(1,2), Box(2,1)]) == box_set_key([Box(2,1)])
+    True
+    """
+    return frozenset(box.key for box in baby_boxes)
+
+class BoundedMemo:
+    """
+    A memo dictionary holding at most maxsize entries, evicting the least
+    recently used one, and counting hits, misses and evictions.
+
+    >>> m = BoundedMemo(maxsize=2)
+    >>> m['a'] = 1; m['b'] = 2
+    >>> m.get('a'), m.get('z')
+    (1, None)
+    >>> m['c'] = 3
+    >>> 'b' in m, 'a' in m, len(m)
+    (False, True, 2)
+    >>> m.stats() == dict(hits=1, misses=1, evictions=1, size=2, maxsize=2)
+    True
+    """
+    def __init__(self, maxsize=1 << 16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            value = self.__entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.__entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.__entries[key] = value
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.maxsize:
+            self.__entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.__entries.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, size=len(self.__entries),
+                    maxsize=self.maxsize)
+
+def largest_box_chain(baby_boxes, mama_box):
+    """
+    Returns a longest list of baby_boxes, smallest first, in which every
+    box fits inside the next one and the last one fits inside mama_box.
+
+    Rather than recursing, this is a longest increasing subsequence:
+    once the candidates are sorted by their smaller side, a chain is a
+    run whose larger sides strictly increase. Sorting boxes with equal
+    smaller sides by decreasing larger side keeps two of them from ever
+    being chained, since neither fits inside the other.
+
+    Efficiency: O(n log(n)) where n = len(baby_boxes), or O(n log(k))
+        for k boxes that fit inside mama_box if baby_boxes is a BoxSet.
+
+    >>> b = (Box(1,3), Box(4,2), Box(1,5), Box(6,2), Box(7,4), Box(2,6))
+    >>> [str(box) for box in largest_box_chain(b, Box(8,8))]
+    ['(1,3)', '(4,2)', '(7,4)']
+    >>> largest_box_chain(b, Box(1,1))
+    []
+    >>> [str(box) for box in largest_box_chain((Box(2,2), Box(2,2)), Box(3,3))]
+    ['(2,2)']
+    """
+    if not isinstance(baby_boxes, BoxSet):
+        baby_boxes = BoxSet(baby_boxes)
+    # Already in (smaller side, decreasing larger side) order
+    candidates = baby_boxes.fitting_in(mama_box)
+    length, parent = nesting_lengths(candidates)
+
+    chain = []
+    i = max(range(len(length)), key=length.__getitem__, default=None)
+    while i is not None:
+        chain.append(candidates[i])
+        i = parent[i]
+
+    chain.reverse()
+    return chain
+
+def nesting_lengths(sorted_boxes):
+    """
+    For boxes in BoxSet order, returns (length, parent) where length[i] is
+    the number of boxes in the longest chain ending at box i, counting it,
+    and parent[i] the position of the box before it in that chain.
+
+    >>> bs = BoxSet((Box(1,3), Box(4,2), Box(1,5), Box(2,6)))
+    >>> [str(b) for b in bs]
+    ['(1,5)', '(1,3)', '(2,6)', '(4,2)']
+    >>> nesting_lengths(bs)
+    ([1, 1, 2, 2], [None, None, 1, 1])
+    """
+    # tails[k] is the smallest larger side that ends a chain of k+1 boxes
+    # so far, and tail_at[k] the position of that box.
+    tails = []
+    tail_at = []
+    length = [0] * len(sorted_boxes)
+    parent = [None] * len(sorted_boxes)
+
+    for i, box in enumerate(sorted_boxes):
+        hi = box.hi
+        k = bisect_left(tails, hi)
+        length[i] = k + 1
+        if k > 0:
+            parent[i] = tail_at[k - 1]
+
+        if k == len(tails):
+            tails.append(hi)
+            tail_at.append(i)
+        else:
+            tails[k] = hi
+            tail_at[k] = i
+
+    return length, parent
+
+def largest_box_subset_recursive(baby_boxes, mama_box, memo = None):
+    """
+    The top-down recurrence exactly as stated for largest_box_subset,
+    kept as the reference the faster solver is checked against.
+
+    >>> b = (Box(1,3), Box(4,2), Box(1,5), Box(6,2), Box(7,4),Box(2,6))
+    >>> largest_box_subset_recursive(b,Box(8,8))
+    4
+    """
+    if memo is None:
+        memo = {}
+
+    return _largest_box_subset_recursive(baby_boxes, box_set_key(baby_boxes),
+                                            mama_box, memo)
+
+def _largest_box_subset_recursive(baby_boxes, set_key, mama_box, memo):
+    key = (set_key, mama_box.key)
+    if key in memo:
+        return memo[key]
+
+    best = 1
+    for child in baby_boxes:
+        if child < mama_box:
+            best = max(best, 1 + _largest_box_subset_recursive(
+                                        baby_boxes, set_key, child, memo))
+
+    memo[key] = best
+    return best
+
+class MatryoshkaIndex:
+    """
+    Answers largest_box_subset for one fixed set of baby boxes and any
+    number of mama boxes.
+
+    Building the index runs the longest increasing subsequence pass once,
+    which gives for every box the length of the longest chain ending at
+    it. A query is then "the longest chain ending at any box that fits in
+    mama_box": a maximum over boxes with a smaller lo (a prefix of the
+    sorted order) and a smaller hi. The prefix is split as in a Fenwick
+    tree into O(log n) blocks, each keeping its boxes sorted by hi with
+    running maxima, so a query is O(log n) bisections.
+
+    Efficiency: O(n log^2(n)) to build, O(n log(n)) memory,
+        O(log^2(n)) per query.
+
+    >>> b = (Box(1,3), Box(4,2), Box(1,5), Box(6,2), Box(7,4),Box(2,6))
+    >>> index = MatryoshkaIndex(b)
+    >>> index.query(Box(8,8)), index.query(Box(5,5)), index.query(Box(1,1))
+    (4, 3, 1)
+    >>> [str(box) for box in index.chain(Box(8,8))]
+    ['(1,3)', '(4,2)', '(7,4)']
+    >>> index.query_many([Box(8,8), Box(2,7)])
+    [4, 2]
+
+    >>> import random
+    >>> rng = random.Random(33)
+    >>> b = tuple(Box(rng.randint(1, 30), rng.randint(1, 30))
+    ...           for _ in range(300))
+    >>> index = MatryoshkaIndex(b)
+    >>> for _ in range(300):
+    ...     mama = Box(rng.randint(1, 32), rng.randint(1, 32))
+    ...     chain = index.chain(mama)
+    ...     assert len(chain) + 1 == largest_box_subset(b, mama)
+    ...     assert all(x < y for x, y in zip(chain, chain[1:] + [mama]))
+    """
+    def __init__(self, baby_boxes):
+        if not isinstance(baby_boxes, BoxSet):
+            baby_boxes = BoxSet(baby_boxes)
+        self.__boxes = baby_boxes
+        n = len(baby_boxes)
+
+        # Longest chain ending at each box, and the box before it.
+        length, self.__parent = nesting_lengths(baby_boxes)
+
+        # Fenwick block j (1-based) covers positions j - (j & -j) .. j - 1,
+        # stored as his ascending with the running best (length, position).
+        self.__los = [box.lo for box in baby_boxes]
+        self.__block_his = [None] * (n + 1)
+        self.__block_best = [None] * (n + 1)
+        for j in range(1, n + 1):
+            members = sorted(range(j - (j & -j), j),
+                                key=lambda i: baby_boxes[i].hi)
+            best, running = (0, None), []
+            for i in members:
+                best = max(best, (length[i], i), key=lambda pair: pair[0])
+                running.append(best)
+            self.__block_his[j] = [baby_boxes[i].hi for i in members]
+            self.__block_best[j] = running
+
+    def __best_fitting(self, mama_box):
+        best = (0, None)
+        j = bisect_left(self.__los, mama_box.lo)
+        while j > 0:
+            c = bisect_left(self.__block_his[j], mama_box.hi)
+            if c and self.__block_best[j][c - 1][0] > best[0]:
+                best = self.__block_best[j][c - 1]
+            j -= j & -j
+
+        return best
+
+    def query(self, mama_box):
+        """
+        Same as largest_box_subset(baby_boxes, mama_box).
+        """
+        return 1 + self.__best_fitting(mama_box)[0]
+
+    def query_many(self, mama_boxes):
+        return [self.query(mama_box) for mama_box in mama_boxes]
+
+    def chain(self, mama_box):
+        """
+        Same as largest_box_chain(baby_boxes, mama_box), smallest first.
+        """
+        chain = []
+        i = self.__best_fitting(mama_box)[1]
+        while i is not None:
+            chain.append(self.__boxes[i])
+            i = self.__parent[i]
+
+        chain.reverse()
+        return chain
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Alternative routes by the penalty method: after each route found, the
+# edges on it are made more expensive and the search is run again, so
+# that the next route prefers other roads. Candidates that are too long
+# compared to the best route, or share too much of it with a route
+# already chosen, are dropped.
+#
+# The searches share one shortest-path tree. A single reverse search
+# from dest gives the exact cost d(v) from every vertex to dest under
+# the unpenalized costs. Penalties only raise costs, so d is an exact
+# A* heuristic for the first search and a lower bound for all later
+# ones. A vertex with d(v) above max_stretch times the best cost cannot
+# be on an acceptable route, so the tree is only grown that far and the
+# searches never leave it.
+#
+# With a turn table attached to the server every search respects it, and
+# route costs include the turns made. Turns only add cost, so d is still
+# a lower bound.
+
+import doctest
+
+# Local modules
+from .partition import dijkstra
+
+INF = float('inf')
+
+def route_cost(cost, path, turns=None):
+    """
+    The cost of the edges of path, plus that of its turns if a TurnTable
+    is given.
+
+    >>> from .turns import TurnTable
+    >>> route_cost(lambda e: e[1] - e[0], [1, 3, 7])
+    6
+    >>> route_cost(lambda e: 1, [1, 2, 1], TurnTable(u_turn=5))
+    7
+    """
+    total = sum(map(cost, zip(path, path[1:])))
+    if turns is not None:
+        total += sum(turns.cost(u, v, w)
+                     for u, v, w in zip(path, path[1:], path[2:]))
+    return total
+
+def shared_fraction(cost, path, edges):
+    """
+    Fraction of the cost of path that is spent on the given edges.
+
+    >>> shared_fraction(lambda e: e[1] - e[0], [1, 3, 7], {(3, 7)})
+    0.6666666666666666
+    """
+    total = shared = 0
+    for e in zip(path, path[1:]):
+        c = cost(e)
+        total += c
+        if e in edges:
+            shared += c
+    return shared / total if total else 1.0
+
+def alternative_routes(server, reverse, start, dest, k=3, max_stretch=1.4,
+                       max_overlap=0.7, penalty=1.4, max_tries=None):
+    """
+    Up to k routes from start to dest, cheapest first, the first being
+    the least cost path. See Server.alternative_routes.
+
+    Args:
+        reverse (dict): Maps each vertex to the vertices with an edge
+            into it.
+    """
+    if penalty <= 1:
+        raise ValueError("penalty must be greater than 1")
+    if max_stretch < 1:
+        raise ValueError("max_stretch must be at least 1")
+
+    cost = server.edge_cost
+    turns = server.turns()
+    best = server.least_cost_path_internal(start, dest)
+    if len(best) < 2 or k < 2:
+        return [best] if best else []
+
+    limit = route_cost(cost, best, turns) * max_stretch
+    backward = lambda v: [(u, cost((u, v))) for u in reverse[v]]
+    to_dest, _ = dijkstra(backward, dest, limit=limit)
+
+    factors = {}
+    def penalized(e):
+        if e[1] not in to_dest:
+            # Too far from dest for any acceptable route
+            return INF
+        return cost(e) * factors.get(e, 1)
+
+    routes = [best]
+    chosen = [set(zip(best, best[1:]))]
+    seen = {tuple(best)}
+    path = best
+    for _ in range(max_tries if max_tries is not None else 4 * k):
+        if len(routes) >= k:
+            break
+
+        for e in zip(path, path[1:]):
+            factors[e] = factors.get(e, 1) * penalty
+        if turns is not None:
+            path = server.least_cost_path_turns(start, dest, penalized, turns,
+                                                to_dest.get)
+        else:
+            path = server.least_cost_path(start, dest, penalized, to_dest.get)
+        if not path:
+            break
+        if tuple(path) in seen:
+            # Not penalized enough yet to give way to another route
+            continue
+        seen.add(tuple(path))
+
+        if route_cost(cost, path, turns) > limit:
+            continue
+        if any(shared_fraction(cost, path, edges) > max_overlap
+                for edges in chosen):
+            continue
+
+        routes.append(path)
+        chosen.append(set(zip(path, path[1:])))
+
+    first, rest = routes[0], routes[1:]
+    rest.sort(key=lambda p: route_cost(cost, p, turns))
+    return [first] + rest
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Routing benchmarks. Every workload is seeded so that two runs over the
+# same inputs measure exactly the same operations, and every result is a
+# JSON object on its own line so that runs can be diffed or plotted.
+#
+# Run with:
+#   $ python3 -m proj1.bench --sizes 1000 10000 100000
+#   $ python3 -m proj1.bench --roads edmonton-roads-2.0.1.txt --output run.jsonl
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import doctest
+import argparse
+import tempfile
+import tracemalloc
+
+# Local modules
+from .graph_v2 import (
+    DEFAULT_ROADS_PATH,
+    counting_components,
+    deserialize_graph,
+    random_grid_arrays,
+    write_roads_file,
+)
+from .server import Server
+from .repl import Repl
+from .binary_heap import BinaryHeap
+
+def percentile(sorted_samples, pct):
+    """
+    Nearest-rank percentile of an already sorted list of samples.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    >>> percentile([7], 0)
+    7
+    """
+    rank = max(1, int(math.ceil(pct / 100 * len(sorted_samples))))
+    return sorted_samples[rank - 1]
+
+def summarize(samples, ops_per_sample=1):
+    """
+    Latency percentiles in milliseconds and throughput in
+    operations per second for a list of timings in seconds. Without
+    any timings the count is 0 and every statistic None.
+
+    >>> s = summarize([0.001, 0.002, 0.003, 0.004])
+    >>> s['count'], s['p50_ms'], s['max_ms'], s['ops_per_sec']
+    (4, 2.0, 4.0, 400.0)
+    >>> s = summarize([])
+    >>> s['count'], s['mean_ms'], s['ops_per_sec']
+    (0, None, None)
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return dict(count=0, mean_ms=None, p50_ms=None, p90_ms=None,
+                    p99_ms=None, max_ms=None, ops_per_sec=None)
+    total = sum(ordered)
+    ms = lambda v: round(v * 1000, 6)
+    return {
+        'count':        len(ordered),
+        'mean_ms':      ms(total / len(ordered)),
+        'p50_ms':       ms(percentile(ordered, 50)),
+        'p90_ms':       ms(percentile(ordered, 90)),
+        'p99_ms':       ms(percentile(ordered, 99)),
+        'max_ms':       ms(ordered[-1]),
+        'ops_per_sec':  round(len(ordered) * ops_per_sample / total, 3)
+                            if total else float('inf'),
+    }
+
+def timed(fn, args_list):
+    """
+    Call fn once per argument tuple, returning the per-call timings.
+
+    >>> len(timed(max, [(1, 2), (3, 4)]))
+    2
+    """
+    samples = []
+    clock = time.perf_counter
+    for args in args_list:
+        began = clock()
+        fn(*args)
+        samples.append(clock() - began)
+
+    return samples
+
+def peak_memory(fn, *args):
+    """
+    Peak number of bytes allocated by Python while running fn(*args).
+
+    >>> peak_memory(lambda n: [0] * n, 100000) >= 800000
+    True
+    """
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def heap_workload(n, seed):
+    rng = random.Random(seed)
+    keys = [rng.random() for _ in range(n)]
+
+    def run():
+        h = BinaryHeap()
+        for i, key in enumerate(keys):
+            h.add(i, key)
+        while len(h):
+            h.pop_min()
+
+    return run
+
+class Bench:
+    """
+    Runs every workload against one road network and yields one
+    result record per workload.
+    """
+    def __init__(self, dataset, roads_path, queries=100, snaps=10,
+                 seed=0, memory=True, alternatives=(1, 2, 3, 5)):
+        self.__dataset = dataset
+        self.__roads_path = roads_path
+        self.__queries = queries
+        self.__snaps = snaps
+        self.__alternatives = alternatives
+        self.__seed = seed
+        self.__memory = memory
+
+    def record(self, workload, samples, ops_per_sample=1, fn=None, args=()):
+        result = dict(dataset=self.__dataset, workload=workload)
+        result.update(summarize(samples, ops_per_sample))
+        # Nothing was run to take the memory of without samples
+        if self.__memory and fn is not None and samples:
+            result['peak_bytes'] = peak_memory(fn, *args)
+        return result
+
+    def run(self):
+        path = self.__roads_path
+        samples = timed(deserialize_graph, [(path,)])
+        yield self.record('deserialize_graph', samples,
+                            fn=deserialize_graph, args=(path,))
+
+        # Peak memory is left out: most of it is in the worker processes
+        samples = timed(deserialize_graph, [(path, None, 0)])
+        yield self.record('deserialize_graph_parallel', samples)
+
+        g, vmap = deserialize_graph(path)
+        samples = timed(Server, [(g, vmap)])
+        yield self.record('server_build', samples,
+                            fn=Server, args=(g, vmap))
+
+        srv = Server(g, vmap)
+        rpl = Repl(srv, vmap)
+        rng = random.Random(self.__seed)
+        ids = sorted(vmap.keys())
+
+        points = [vmap[rng.choice(ids)] for _ in range(self.__snaps)]
+        samples = timed(rpl.closest_point,
+                        [(p['lat'] + 7, p['lon'] - 7) for p in points])
+        yield self.record('closest_point', samples)
+
+        pairs = [(rng.choice(ids), rng.choice(ids))
+                    for _ in range(self.__queries)]
+        samples = timed(srv.least_cost_path_internal, pairs)
+        yield self.record('least_cost_path', samples,
+                            fn=srv.least_cost_path_internal,
+                            args=pairs[0] if pairs else ())
+
+        # A tenth of the pairs: each query is up to 4 * k searches
+        few = pairs[:max(1, len(pairs) // 10)]
+        if few:
+            # Builds the reverse adjacency the server keeps, once
+            srv.alternative_routes(*few[0], k=2)
+        for k in self.__alternatives:
+            found = []
+            run = lambda start, dest: found.append(
+                        len(srv.alternative_routes(start, dest, k=k)))
+            samples = timed(run, few)
+            result = self.record('alternative_routes_k%d'%(k), samples,
+                                 fn=srv.alternative_routes,
+                                 args=few[0] + (k,) if few else ())
+            result['mean_routes'] = (round(sum(found) / len(found), 3)
+                                        if found else None)
+            yield result
+
+        samples = timed(counting_components, [(g,)])
+        yield self.record('counting_components', samples,
+                            fn=counting_components, args=(g,))
+
+        n = min(len(ids), 100000)
+        run = heap_workload(n, self.__seed)
+        samples = timed(run, [()] * 3)
+        yield self.record('binary_heap', samples, ops_per_sample=2 * n,
+                            fn=run)
+
+def synthetic_benches(sizes, workdir, **kwargs):
+    """
+    Yields a Bench per size over a grid network of about that many
+    vertices, written out as a roads file so that loading is measured too.
+    """
+    seed = kwargs.get('seed', 0)
+    for size in sizes:
+        side = max(2, int(round(math.sqrt(size))))
+        path = os.path.join(workdir, 'grid-%d.txt'%(side * side))
+        write_roads_file(path, *random_grid_arrays(side, side, seed=seed))
+        yield Bench('grid-%d'%(side * side), path, **kwargs)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark graph loading, snapping and routing.')
+    parser.add_argument('--roads', default=DEFAULT_ROADS_PATH,
+                        help='roads file to benchmark (default: %(default)s)')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[1000, 10000],
+                        help='vertex counts of synthetic grid networks')
+    parser.add_argument('--queries', type=int, default=100,
+                        help='random origin/destination pairs to route')
+    parser.add_argument('--snaps', type=int, default=10,
+                        help='random points to snap to the network')
+    parser.add_argument('--alternatives', type=int, nargs='*',
+                        default=[1, 2, 3, 5], metavar='K',
+                        help='numbers of alternative routes to time')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the tracemalloc peak memory passes')
+    parser.add_argument('--output', help='write JSON lines here, not stdout')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    opts = dict(queries=args.queries, snaps=args.snaps,
+                seed=args.seed, memory=args.memory,
+                alternatives=args.alternatives)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            benches = list(synthetic_benches(args.sizes, workdir, **opts))
+            if os.path.exists(args.roads):
+                benches.insert(0, Bench(os.path.basename(args.roads),
+                                        args.roads, **opts))
+            else:
+                print('# skipping missing roads file', args.roads,
+                        file=sys.stderr)
+
+            for bench in benches:
+                for result in bench.run():
+                    out.write(json.dumps(result, sort_keys=True) + '\n')
+                    out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+def tester():
+    doctest.testmod()
+
+if __name__ == '__main__':
+    main()
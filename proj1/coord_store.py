@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Vertex coordinates in a packed, memory-mapped file. Every process that
+# opens the same file shares its pages through the OS page cache instead of
+# holding one dictionary per vertex, yet reads look like the vertex_map
+# returned by deserialize_graph.
+#
+# File layout, all little-endian:
+#   8 bytes   magic b'W2015CRD'
+#   uint32    format version
+#   uint32    number of vertices n
+#   int64[n]  vertex ids, ascending (the dense index)
+#   int32[n]  latitudes in hundred-thousandths of a degree
+#   int32[n]  longitudes in hundred-thousandths of a degree
+
+import os
+import doctest
+import itertools
+import contextlib
+
+import numpy as np
+
+MAGIC = b'W2015CRD'
+VERSION = 1
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('count', '<u4')])
+
+class CoordStoreError(Exception):
+    pass
+
+# Numbers the temporary files this process writes; next() on it is atomic
+_partials = itertools.count()
+
+@contextlib.contextmanager
+def replacing(filename):
+    """
+    Yields a binary file to write filename's new contents to. The file
+    only takes filename's place once the block finishes, so readers never
+    map a half-written file, and it is removed if the block raises.
+    Every writer gets its own temporary name, so writers racing on the
+    same filename cannot write into each other's file; the last one to
+    finish wins.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = os.path.join(d, 'out.bin')
+    ...     with replacing(path) as f, replacing(path) as g:
+    ...         _ = f.write(b'first'); _ = g.write(b'second')
+    ...     open(path, 'rb').read(), os.listdir(d)
+    (b'first', ['out.bin'])
+    """
+    partial = '%s.%d.%d.partial'%(filename, os.getpid(), next(_partials))
+    f = open(partial, 'xb')
+    try:
+        with f:
+            yield f
+        os.replace(partial, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(partial)
+        raise
+
+def coordinate_arrays(vertex_map):
+    """
+    Returns (ids, lats, lons) as numpy arrays sorted by vertex id,
+    suitable for looking up many vertices at once with lookup_coordinates.
+
+    A vertex_map that already keeps its coordinates in columns, such
+    as a CoordStore, returns them as they are.
+
+    >>> ids, lats, lons = coordinate_arrays({
+    ...     9: dict(id=9, lat=10, lon=20), 4: dict(id=4, lat=-1, lon=-2)})
+    >>> ids.tolist(), lats.tolist(), lons.tolist()
+    ([4, 9], [-1, 10], [-2, 20])
+    """
+    if hasattr(vertex_map, 'coordinate_arrays'):
+        return vertex_map.coordinate_arrays()
+
+    ids = np.fromiter(vertex_map.keys(), dtype=np.int64, count=len(vertex_map))
+    order = np.argsort(ids, kind='stable')
+    values = list(vertex_map.values())
+    lats = np.fromiter((v['lat'] for v in values),
+                        dtype=np.int64, count=len(values))
+    lons = np.fromiter((v['lon'] for v in values),
+                        dtype=np.int64, count=len(values))
+
+    return ids[order], lats[order], lons[order]
+
+def lookup_coordinates(coords, v_ids):
+    """
+    Vectorized retrieve_attrs: returns the (lats, lons) of every vertex
+    in v_ids, with (0, 0) for vertices that have no coordinates.
+
+    >>> coords = coordinate_arrays({4: dict(id=4, lat=-1, lon=-2)})
+    >>> lats, lons = lookup_coordinates(coords, np.array([4, 7, 4]))
+    >>> lats.tolist(), lons.tolist()
+    ([-1, 0, -1], [-2, 0, -2])
+    """
+    ids, lats, lons = coords
+    v_ids = np.asarray(v_ids)
+    if not len(ids):
+        zeros = np.zeros(len(v_ids), dtype=np.int64)
+        return zeros, zeros
+
+    index = np.minimum(np.searchsorted(ids, v_ids), len(ids) - 1)
+    found = ids[index] == v_ids
+
+    return np.where(found, lats[index], 0), np.where(found, lons[index], 0)
+
+def write_coord_store(filename, vertex_map):
+    """
+    Pack the coordinates of vertex_map into filename.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = os.path.join(d, 'coords.bin')
+    ...     write_coord_store(path, {7: dict(id=7, lat=-5, lon=9)})
+    ...     os.path.getsize(path)
+    32
+    """
+    ids, lats, lons = coordinate_arrays(vertex_map)
+    header = np.array([(MAGIC, VERSION, len(ids))], dtype=HEADER)
+
+    with replacing(filename) as f:
+        f.write(header.tobytes())
+        f.write(ids.astype('<i8').tobytes())
+        f.write(lats.astype('<i4').tobytes())
+        f.write(lons.astype('<i4').tobytes())
+
+class CoordStore:
+    """
+    Read-only, dict-like view of a coordinate file. get and [] return
+    the same {'id', 'lat', 'lon'} dictionaries that deserialize_graph
+    puts in its vertex_map, built on demand.
+
+    >>> import tempfile
+    >>> vmap = {9: dict(id=9, lat=10, lon=20), 4: dict(id=4, lat=-1, lon=-2)}
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = os.path.join(d, 'coords.bin')
+    ...     write_coord_store(path, vmap)
+    ...     store = CoordStore(path)
+    ...     print(store.get(9), store.get(5), len(store), 4 in store)
+    ...     print(dict(store.items()) == vmap)
+    ...     store.close()
+    {'id': 9, 'lat': 10, 'lon': 20} None 2 True
+    True
+    """
+    def __init__(self, filename):
+        raw = np.memmap(filename, dtype=np.uint8, mode='r')
+        if len(raw) < HEADER.itemsize:
+            raise CoordStoreError("%s: too short for a header"%(filename))
+
+        header = raw[:HEADER.itemsize].view(HEADER)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise CoordStoreError("%s: not a version %d coordinate file"%(
+                                                        filename, VERSION))
+
+        n = int(header['count'])
+        start = HEADER.itemsize
+        if len(raw) != start + 16 * n:
+            raise CoordStoreError("%s: truncated"%(filename))
+
+        self.__attach(raw, start, n)
+
+    @classmethod
+    def from_buffer(cls, raw, start, n):
+        """
+        A CoordStore over n vertices whose ids, lats and lons columns are
+        packed at raw[start:], as in a coordinate file after its header.
+        """
+        store = cls.__new__(cls)
+        store.__attach(raw, start, n)
+        return store
+
+    def __attach(self, raw, start, n):
+        self.__raw = raw
+        self.__ids = raw[start:start + 8*n].view('<i8')
+        start += 8 * n
+        self.__lats = raw[start:start + 4*n].view('<i4')
+        start += 4 * n
+        self.__lons = raw[start:start + 4*n].view('<i4')
+
+    def close(self):
+        mm = getattr(self.__raw, '_mmap', None)
+        self.__raw = self.__ids = self.__lats = self.__lons = None
+        if mm is not None:
+            mm.close()
+
+    def coordinate_arrays(self):
+        """
+        The (ids, lats, lons) columns, as coordinate_arrays would
+        return them for the equivalent vertex_map.
+        """
+        return self.__ids, self.__lats, self.__lons
+
+    def index(self, v_id):
+        """
+        Position of v_id in the columns, or -1 if it is not stored.
+        """
+        ids = self.__ids
+        i = int(np.searchsorted(ids, v_id))
+        if i < len(ids) and ids[i] == v_id:
+            return i
+        return -1
+
+    def get(self, v_id, default=None):
+        i = self.index(v_id)
+        if i < 0:
+            return default
+        return {'id': int(self.__ids[i]), 'lat': int(self.__lats[i]),
+                'lon': int(self.__lons[i])}
+
+    def __getitem__(self, v_id):
+        retr = self.get(v_id)
+        if retr is None:
+            raise KeyError(v_id)
+        return retr
+
+    def __contains__(self, v_id):
+        return self.index(v_id) >= 0
+
+    def __len__(self):
+        return len(self.__ids)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self.__ids.tolist()
+
+    def values(self):
+        for v_id, lat, lon in zip(self.__ids.tolist(), self.__lats.tolist(),
+                                  self.__lons.tolist()):
+            yield {'id': v_id, 'lat': lat, 'lon': lon}
+
+    def items(self):
+        for v in self.values():
+            yield v['id'], v
+
+def open_coord_store(filename, vertex_map, source_path=None):
+    """
+    Open the coordinate file, first (re)building it from vertex_map if it
+    is missing, unreadable or older than source_path, the roads file it
+    was made from.
+    """
+    try:
+        stale = source_path is not None and \
+                    os.path.getmtime(filename) < os.path.getmtime(source_path)
+        if not stale:
+            return CoordStore(filename)
+    except (OSError, ValueError, CoordStoreError):
+        pass
+
+    write_coord_store(filename, vertex_map)
+    return CoordStore(filename)
+
+if __name__ == '__main__':
+    doctest.testmod()
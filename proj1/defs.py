@@ -1,5 +1,19 @@
 #!/usr/bin/env python3
+# The first field of every line of the serial protocol, shared by the
+# Repl that reads them and the encoder that writes route replies.
 
 ACK  = 'A'
 RECV = 'R'
 WAYPOINT_PREFIX = 'N'
+
+Acknowledgement = ACK
+StartOfSession  = 'starting'
+EndOfSession    = 'E'
+Request         = RECV
+PathLength      = WAYPOINT_PREFIX
+WayPoint        = 'W'
+DetailLevel     = 'L'
+PixelPoint      = 'P'
+PixelDelta      = 'D'
+Unknown         = 'U'
+Comment         = '#'
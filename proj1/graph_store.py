@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# The whole road network, coordinates and edge costs in one packed,
+# memory-mapped file, for running one server process per device: each
+# process maps the same file read-only, so it starts without parsing the
+# roads file and the pages are shared through the OS page cache instead
+# of every process holding its own Graph, vertex_map and cost map.
+#
+# File layout, all little-endian:
+#   8 bytes      magic b'W2015GRF'
+#   uint32       format version
+#   uint32       number of vertices n
+#   uint64       number of edges m
+#   16 bytes     name of the metric the costs were computed with
+#   uint32       fixed-point scale of the costs, 0 if they are not rounded
+#   uint32       0, keeps the arrays below 8-byte aligned
+#   int64[n]     vertex ids, ascending (the dense index)
+#   int32[n]     latitudes in hundred-thousandths of a degree
+#   int32[n]     longitudes in hundred-thousandths of a degree
+#   int64[n+1]   offsets: the edges out of vertex i are offsets[i]:offsets[i+1]
+#   int64[m]     edge destinations, as vertex ids
+#   float64[m]   edge costs
+
+import os
+import doctest
+
+import numpy as np
+
+# Local modules
+from .coord_store import (CoordStore, coordinate_arrays, lookup_coordinates,
+                          replacing)
+from .metrics import DEFAULT_METRIC, get_metric, to_fixed_point
+
+MAGIC = b'W2015GRF'
+VERSION = 2
+HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'), ('count', '<u4'),
+                   ('edges', '<u8'), ('metric', 'S16'), ('fixed_point', '<u4'),
+                   ('padding', '<u4')])
+
+class GraphStoreError(Exception):
+    pass
+
+def write_graph_store(filename, graph, vertex_map, metric=None,
+                      fixed_point=None):
+    """
+    Pack graph, the coordinates of its vertices and the cost of every
+    edge under metric into filename, rounded to 1/fixed_point units of
+    the metric if fixed_point is given (see Server).
+    """
+    metric = metric or DEFAULT_METRIC
+    coords = coordinate_arrays(vertex_map)
+    ids = np.array(sorted(graph.vertices()), dtype=np.int64)
+    lats, lons = lookup_coordinates(coords, ids)
+
+    src, dst = graph.edge_arrays()
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    # Stable, so that each vertex keeps its neighbours in graph order
+    order = np.argsort(np.searchsorted(ids, src), kind='stable')
+    src, dst = src[order], dst[order]
+    offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.searchsorted(ids, src), minlength=len(ids)),
+              out=offsets[1:])
+
+    src_lat, src_lon = lookup_coordinates(coords, src)
+    dst_lat, dst_lon = lookup_coordinates(coords, dst)
+    weights = np.asarray(get_metric(metric)(src_lat, src_lon, dst_lat, dst_lon),
+                         dtype=np.float64)
+    if fixed_point is not None:
+        # Whole numbers, stored exactly as float64
+        weights = to_fixed_point(weights, fixed_point).astype(np.float64)
+
+    header = np.array([(MAGIC, VERSION, len(ids), len(dst),
+                        metric.encode('ascii'), fixed_point or 0, 0)],
+                      dtype=HEADER)
+
+    with replacing(filename) as f:
+        f.write(header.tobytes())
+        f.write(ids.astype('<i8').tobytes())
+        f.write(lats.astype('<i4').tobytes())
+        f.write(lons.astype('<i4').tobytes())
+        f.write(offsets.astype('<i8').tobytes())
+        f.write(dst.astype('<i8').tobytes())
+        f.write(weights.astype('<f8').tobytes())
+
+class GraphStore:
+    """
+    Read-only view of a graph file with the methods of Graph that the
+    server uses. vertex_map() and costs() give the matching vertex_map
+    and cost map for Server.
+
+    >>> import tempfile
+    >>> from .graph_v2 import Graph
+    >>> g = Graph({1, 2, 3}, [(1, 2), (2, 1), (2, 3), (1, 3)])
+    >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=3, lon=4),
+    ...         3: dict(id=3, lat=3, lon=0)}
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = os.path.join(d, 'graph.bin')
+    ...     write_graph_store(path, g, vmap)
+    ...     store = GraphStore(path)
+    ...     print(store.neighbours(1), store.neighbours(3), store.is_edge((2, 3)))
+    ...     print(sorted(store.edges()) == sorted(g.edges()))
+    ...     costs = store.costs()
+    ...     print(costs.get((1, 2)), costs.get((3, 1), 'none'), store.vertex_map()[2])
+    ...     store.close()
+    [2, 3] [] True
+    True
+    5.0 none {'id': 2, 'lat': 3, 'lon': 4}
+    """
+    def __init__(self, filename):
+        raw = np.memmap(filename, dtype=np.uint8, mode='r')
+        if len(raw) < HEADER.itemsize:
+            raise GraphStoreError("%s: too short for a header"%(filename))
+
+        header = raw[:HEADER.itemsize].view(HEADER)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise GraphStoreError("%s: not a version %d graph file"%(
+                                                        filename, VERSION))
+
+        n, m = int(header['count']), int(header['edges'])
+        start = HEADER.itemsize
+        if len(raw) != start + 24 * n + 8 + 16 * m:
+            raise GraphStoreError("%s: truncated"%(filename))
+
+        self.metric = header['metric'].decode('ascii')
+        self.fixed_point = int(header['fixed_point']) or None
+        self.__raw = raw
+        self.__coords = CoordStore.from_buffer(raw, start, n)
+        start += 16 * n
+        self.__offsets = raw[start:start + 8*(n+1)].view('<i8')
+        start += 8 * (n + 1)
+        self.__targets = raw[start:start + 8*m].view('<i8')
+        start += 8 * m
+        self.__weights = raw[start:start + 8*m].view('<f8')
+        self.__last = (None, {})
+
+    def close(self):
+        mm = getattr(self.__raw, '_mmap', None)
+        self.__raw = self.__offsets = self.__targets = self.__weights = None
+        self.__coords = None
+        if mm is not None:
+            mm.close()
+
+    def vertex_map(self):
+        return self.__coords
+
+    def costs(self):
+        return EdgeCosts(self)
+
+    def __row(self, v):
+        i = self.__coords.index(v)
+        if i < 0:
+            return 0, 0
+        return int(self.__offsets[i]), int(self.__offsets[i + 1])
+
+    def vertices(self):
+        return set(self.__coords.keys())
+
+    def is_vertex(self, v):
+        return v in self.__coords
+
+    def neighbours(self, v):
+        lo, hi = self.__row(v)
+        return self.__targets[lo:hi].tolist()
+
+    def is_edge(self, e):
+        return e[1] in self.neighbours(e[0])
+
+    def weight(self, e, default=None):
+        u, v = e
+        # A search asks for the costs of every edge out of the vertex it is
+        # expanding in a row, so the last row is kept. The vertex and its
+        # costs are swapped in one assignment, so threads sharing the store
+        # never see one vertex paired with another's costs.
+        last, costs = self.__last
+        if u != last:
+            lo, hi = self.__row(u)
+            weights = self.__weights[lo:hi]
+            if self.fixed_point is not None:
+                weights = weights.astype(np.int64)
+            costs = dict(zip(self.__targets[lo:hi].tolist(),
+                             weights.tolist()))
+            self.__last = (u, costs)
+        return costs.get(v, default)
+
+    def edge_arrays(self):
+        ids = self.__coords.coordinate_arrays()[0]
+        src = np.repeat(np.asarray(ids), np.diff(self.__offsets))
+        return src, np.asarray(self.__targets)
+
+    def edge_weights(self):
+        """
+        The cost of every edge, aligned with edge_arrays().
+        """
+        return np.asarray(self.__weights)
+
+    def edges(self):
+        src, dst = self.edge_arrays()
+        return list(zip(src.tolist(), dst.tolist()))
+
+    def edge_mappings(self):
+        for v in self.__coords.keys():
+            yield v, self.neighbours(v)
+
+class EdgeCosts:
+    """
+    The cost map of a GraphStore, for Server. Costs are read from the
+    shared file; update_edge_costs writes go to a small per-process
+    overlay, so the file stays read-only.
+    """
+    def __init__(self, store):
+        self.__store = store
+        self.__overlay = {}
+
+    def get(self, e, default=None):
+        cost = self.__overlay.get(e)
+        if cost is None:
+            return self.__store.weight(e, default)
+        return cost
+
+    def __getitem__(self, e):
+        cost = self.get(e)
+        if cost is None:
+            raise KeyError(e)
+        return cost
+
+    def __setitem__(self, e, cost):
+        self.__overlay[e] = cost
+
+    def __contains__(self, e):
+        return self.get(e) is not None
+
+def open_graph_store(filename, load, metric=None, source_path=None,
+                     fixed_point=None):
+    """
+    Open the graph file, first (re)building it if it is missing,
+    unreadable, made with another metric or fixed-point scale, or older
+    than source_path. load() must return the (Graph, vertex_map) to build
+    it from; it is only called when a build is needed.
+
+    >>> import tempfile
+    >>> from .graph_v2 import Graph
+    >>> g = Graph({1, 2}, [(1, 2)])
+    >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=3, lon=4)}
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = os.path.join(d, 'graph.bin')
+    ...     for scale in (None, 16, 16):
+    ...         store = open_graph_store(path, lambda: (g, vmap),
+    ...                                  fixed_point=scale)
+    ...         print(store.fixed_point, store.costs().get((1, 2)))
+    ...         store.close()
+    None 5.0
+    16 80
+    16 80
+    """
+    metric = metric or DEFAULT_METRIC
+    try:
+        stale = source_path is not None and \
+                    os.path.getmtime(filename) < os.path.getmtime(source_path)
+        if not stale:
+            store = GraphStore(filename)
+            if store.metric == metric and store.fixed_point == fixed_point:
+                return store
+            store.close()
+    except (OSError, ValueError, GraphStoreError):
+        pass
+
+    graph, vertex_map = load()
+    write_graph_store(filename, graph, vertex_map, metric, fixed_point)
+    return GraphStore(filename)
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -3,11 +3,18 @@
 # Basic Graph class implementation provided by
 # CMPUT 275 instructors then augmented by myself.
 
+import io
 import os
 import sys
 import math
 import doctest
-import random
+import itertools
+import concurrent.futures
+
+import numpy as np
+
+# Local modules
+from . import hooks
 
 DEFAULT_ROADS_PATH = os.path.join(
                         os.path.dirname(__file__), "edmonton-roads-2.0.1.txt")
@@ -52,6 +59,41 @@ class Graph:
         for e in edges:
             self.add_edge(e)
 
+    @classmethod
+    def from_arrays(cls, vertices, src, dst):
+        """
+        Construct a graph directly into its adjacency storage from an
+        iterable of vertices and two parallel arrays of edge endpoints,
+        bypassing the per-edge checks of add_edge. Every endpoint must
+        be one of the given vertices.
+
+        Efficiency: O(# vertices + (# edges) log(# edges)), with the
+            per-edge work done by numpy.
+
+        >>> g = Graph.from_arrays([1, 2, 3], [1, 2, 1], [2, 3, 3])
+        >>> g._alist == {1: [2, 3], 2: [3], 3: []}
+        True
+        >>> Graph.from_arrays([1], [], [])._alist == {1: []}
+        True
+        """
+        g = cls()
+        alist = g._alist
+        for v in (vertices.tolist() if hasattr(vertices, 'tolist') else vertices):
+            alist[v] = []
+
+        src, dst = np.asarray(src), np.asarray(dst)
+        if not len(src):
+            return g
+
+        order = np.argsort(src, kind='stable')
+        heads, starts = np.unique(src[order], return_index=True)
+        ends = np.append(starts[1:], len(src))
+        dst = dst[order].tolist()
+        for head, start, end in zip(heads.tolist(), starts.tolist(), ends.tolist()):
+            alist[head] = dst[start:end]
+
+        return g
+
     def add_vertex(self, v):
         """
         Add a vertex v to the graph.
@@ -82,6 +124,27 @@ class Graph:
         for k, v in self._alist.items():
             yield k, v
 
+    def edge_arrays(self):
+        """
+        Returns two parallel numpy arrays (sources, destinations)
+        holding the endpoints of every edge, in edge_mappings order.
+
+        Efficiency: O((# vertices) + (# edges))
+
+        >>> g = Graph({1,2,3}, [(1,2),(1,3),(3,1)])
+        >>> src, dst = g.edge_arrays()
+        >>> sorted(zip(src.tolist(), dst.tolist()))
+        [(1, 2), (1, 3), (3, 1)]
+        >>> len(Graph().edge_arrays()[0])
+        0
+        """
+        src, dst = [], []
+        for v, nbrs in self._alist.items():
+            src.extend([v] * len(nbrs))
+            dst.extend(nbrs)
+
+        return np.array(src), np.array(dst)
+
     def add_edge(self, e):
         """
         Add edge e to the graph.
@@ -416,28 +479,123 @@ def parse_edge(split_fields):
 def noop(*args, **kwargs):
     return dict(noop=True)
 
+def parse_line(line):
+    """
+    Returns (head, record) for one line of a roads file.
+
+    >>> parse_line('E,1,2,Angola\\n')
+    ('e', {'start': '1', 'name': 'Angola', 'end': '2'})
+    """
+    parser = noop
+    splits = line.split(',')
+    fields = [field.strip() for field in splits]
+    # print(splits, fields)
+
+    head = fields[0].lower()
+    if head == "v":
+        parser = parse_vertex
+    elif head == "e":
+        parser = parse_edge
+
+    return head, parser(fields)
+
 def read_undirected_city_graph(filename):
     sects = {}
 
     with open(filename, 'r') as f:
         for line in f:
-            parser = noop
-            splits = line.split(',')
-            fields = [field.strip() for field in splits]
-            # print(splits, fields)
-
-            head = fields[0].lower()
-            if head == "v":
-                parser = parse_vertex
-            elif head == "e":
-                parser = parse_edge
-
+            head, record = parse_line(line)
             bucket = sects.setdefault(head, [])
-            bucket.append(parser(fields))
+            bucket.append(record)
 
     return sects
 
-def random_graph(n, m):
+def chunk_ranges(filename, chunks):
+    """
+    Split filename into at most chunks byte ranges [start, end) of about
+    the same size, each starting and ending on a line boundary.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+    ...     f.write('V,1\\nV,2\\nV,3\\n\\nE,1,2,x\\n')
+    ...     f.flush()
+    ...     chunk_ranges(f.name, 3), chunk_ranges(f.name, 100)[:3]
+    21
+    ([(0, 8), (8, 21)], [(0, 4), (4, 8), (8, 12)])
+    """
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, chunks):
+            pos = size * i // chunks
+            if pos <= bounds[-1]:
+                continue
+            # Finish the line that byte pos - 1 is on
+            f.seek(pos - 1)
+            f.readline()
+            if bounds[-1] < f.tell() < size:
+                bounds.append(f.tell())
+
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def read_city_graph_arrays(filename, start, end):
+    """
+    Parse the lines in bytes [start, end) of a roads file, as
+    read_undirected_city_graph would, into a dictionary of arrays:
+    'ids', 'lats' and 'lons' for the V lines and 'starts', 'ends' and
+    'names' for the E lines, each in file order.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    ids, lats, lons = [], [], []
+    starts, ends, names = [], [], []
+    # Decoded and split into lines just as open(filename, 'r') would
+    for line in io.TextIOWrapper(io.BytesIO(data)):
+        head, record = parse_line(line)
+        if head == "v":
+            ids.append(record['id'])
+            lats.append(record['lat'])
+            lons.append(record['lon'])
+        elif head == "e":
+            starts.append(to_id(record['start']))
+            ends.append(to_id(record['end']))
+            names.append(record['name'])
+
+    return dict(ids=np.array(ids, dtype=np.int64),
+                lats=np.array(lats, dtype=np.int64),
+                lons=np.array(lons, dtype=np.int64),
+                starts=np.array(starts, dtype=np.int64),
+                ends=np.array(ends, dtype=np.int64),
+                names=names)
+
+def read_city_graph_parallel(filename, workers=None, chunks=None):
+    """
+    read_city_graph_arrays over the whole file, split into chunks
+    (4 per worker by default) parsed by a pool of worker processes,
+    os.cpu_count() of them by default. With one worker the file is
+    parsed in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = chunk_ranges(filename, chunks or 4 * workers)
+    starts, ends = zip(*ranges)
+
+    if workers == 1:
+        parts = list(map(read_city_graph_arrays, itertools.repeat(filename),
+                         starts, ends))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(read_city_graph_arrays,
+                                  itertools.repeat(filename), starts, ends))
+
+    merged = {key: np.concatenate([part[key] for part in parts])
+                for key in ('ids', 'lats', 'lons', 'starts', 'ends')}
+    merged['names'] = [name for part in parts for name in part['names']]
+    return merged
+
+def random_graph(n, m, seed=None):
     """
     Generate a random graph with n vertices and m edges.
     Each edge (u,v) has both u and v chosen randomly
@@ -445,12 +603,173 @@ def random_graph(n, m):
     
     Useful for seeing how well the search performs on large graphs.
 
-    Efficiency: O(n + m)
+    Efficiency: O(n + m log(m)), vectorized.
+
+    >>> g = random_graph(100, 500, seed=7)
+    >>> len(g.vertices()), len(g.edges())
+    (100, 500)
+    >>> random_graph(100, 500, seed=7).edges() == g.edges()
+    True
     """
     
-    edges = [(random.randint(0,n-1),random.randint(0,n-1)) \
-                 for i in range(m)]
-    return Graph(set(range(n)), edges)
+    rng = np.random.default_rng(seed)
+    src = rng.integers(0, n, size=m)
+    dst = rng.integers(0, n, size=m)
+    return Graph.from_arrays(range(n), src, dst)
+
+# Roughly the south west corner of the Edmonton map, so that generated
+# graphs land where the client's map tiles expect them.
+RANDOM_ORIGIN = (5340000, -11370000)
+
+# Spacing between neighbouring intersections of a generated grid,
+# about 110m of latitude.
+RANDOM_SPACING = 100
+
+def random_grid_arrays(rows, cols, seed=None, spacing=RANDOM_SPACING,
+                       jitter=0.25, drop=0.1):
+    """
+    Generate a road-like grid of rows x cols intersections. Each
+    intersection is jittered by up to jitter * spacing and each street
+    segment is removed with probability drop.
+
+    Returns (lats, lons, src, dst): coordinates in hundred-thousandths
+    indexed by vertex id, and one entry per undirected edge.
+
+    >>> lats, lons, src, dst = random_grid_arrays(3, 4, seed=1, drop=0)
+    >>> len(lats), len(src)
+    (12, 17)
+    >>> bool((src < dst).all())
+    True
+    """
+    rng = np.random.default_rng(seed)
+    n = rows * cols
+    ids = np.arange(n)
+    row, col = ids // cols, ids % cols
+
+    wiggle = int(spacing * jitter)
+    lats = RANDOM_ORIGIN[0] + row * spacing + \
+                rng.integers(-wiggle, wiggle + 1, size=n)
+    lons = RANDOM_ORIGIN[1] + col * spacing + \
+                rng.integers(-wiggle, wiggle + 1, size=n)
+
+    across = ids[col < cols - 1]
+    down = ids[row < rows - 1]
+    src = np.concatenate((across, down))
+    dst = np.concatenate((across + 1, down + cols))
+
+    keep = rng.random(len(src)) >= drop
+    return lats, lons, src[keep], dst[keep]
+
+def morton_order(lats, lons):
+    """
+    Returns the permutation that sorts the points along a Z-order curve,
+    so that points close in the order are close in space.
+
+    >>> morton_order(np.array([0, 0, 1, 1]), np.array([1, 0, 1, 0])).tolist()
+    [1, 0, 3, 2]
+    """
+    def spread(v):
+        v = (v - v.min()).astype(np.uint64) & np.uint64(0xffffffff)
+        for shift, mask in ((16, 0x0000ffff0000ffff), (8, 0x00ff00ff00ff00ff),
+                            (4, 0x0f0f0f0f0f0f0f0f), (2, 0x3333333333333333),
+                            (1, 0x5555555555555555)):
+            v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+        return v
+
+    codes = (spread(lats) << np.uint64(1)) | spread(lons)
+    return np.argsort(codes, kind='stable')
+
+def random_geometric_arrays(n, seed=None, k=2, window=8,
+                            spacing=RANDOM_SPACING):
+    """
+    Generate n intersections scattered uniformly over a square whose
+    density matches a grid with the given spacing. Each intersection
+    is joined to its k nearest intersections among the window that
+    follow it along a Z-order curve, which gives a locally connected,
+    road-like network without an all-pairs nearest neighbour search.
+
+    Returns (lats, lons, src, dst) like random_grid_arrays.
+
+    >>> lats, lons, src, dst = random_geometric_arrays(200, seed=3)
+    >>> len(lats), len(src) == 2 * (200 - 1) - 1
+    (200, True)
+    >>> bool((src != dst).all())
+    True
+    """
+    rng = np.random.default_rng(seed)
+    side = int(math.ceil(math.sqrt(n))) * spacing
+    lats = RANDOM_ORIGIN[0] + rng.integers(0, side, size=n)
+    lons = RANDOM_ORIGIN[1] + rng.integers(0, side, size=n)
+
+    order = morton_order(lats, lons)
+    window = max(1, min(window, n - 1))
+    k = min(k, window)
+
+    # dist[i, j] is the distance from the i-th point in Z-order to
+    # the (i+j+1)-th one; pairs running off the end never get picked.
+    dist = np.full((n, window), np.inf)
+    for j in range(1, window + 1):
+        a, b = order[:n-j], order[j:]
+        dist[:n-j, j-1] = np.hypot(lats[a] - lats[b], lons[a] - lons[b])
+
+    nearest = np.argsort(dist, axis=1)[:, :k]
+    rows = np.repeat(np.arange(n), k)
+    offsets = nearest.ravel() + 1
+    usable = rows + offsets < n
+    src = order[rows[usable]]
+    dst = order[rows[usable] + offsets[usable]]
+
+    return lats, lons, src, dst
+
+def graph_from_arrays(lats, lons, src, dst):
+    """
+    Turn generated (lats, lons, src, dst) arrays into the
+    (Graph, vertex_map) pair returned by deserialize_graph, with every
+    undirected edge stored in both directions.
+
+    >>> g, vmap = graph_from_arrays(*random_grid_arrays(2, 2, seed=5, drop=0))
+    >>> sorted(g.neighbours(0)), sorted(g.neighbours(3))
+    ([1, 2], [1, 2])
+    >>> sorted(vmap[0].keys())
+    ['id', 'lat', 'lon']
+    """
+    ids = range(len(lats))
+    vertex_map = {
+        v: {'id': v, 'lat': lat, 'lon': lon}
+        for v, lat, lon in zip(ids, np.asarray(lats).tolist(),
+                               np.asarray(lons).tolist())
+    }
+    g = Graph.from_arrays(ids, np.concatenate((src, dst)),
+                          np.concatenate((dst, src)))
+
+    return g, vertex_map
+
+def write_roads_file(filename, lats, lons, src, dst, name='Generated'):
+    """
+    Write generated arrays out in the roads file format understood by
+    read_undirected_city_graph, one E line per undirected edge.
+
+    >>> import tempfile
+    >>> arrays = random_grid_arrays(4, 5, seed=2)
+    >>> with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+    ...     write_roads_file(f.name, *arrays)
+    ...     g, vmap = deserialize_graph(f.name)
+    >>> h, hmap = graph_from_arrays(*arrays)
+    >>> vmap == hmap
+    True
+    >>> sorted(g.edges()) == sorted(h.edges())
+    True
+    """
+    # Half a unit up, so that to_hundred_thousandths floors back to
+    # exactly the integer we started from.
+    lat_deg = (np.asarray(lats) + 0.5) / 100000
+    lon_deg = (np.asarray(lons) + 0.5) / 100000
+
+    with open(filename, 'w') as f:
+        f.writelines('V,%d,%.6f,%.6f\n'%(v, lat, lon) for v, lat, lon in
+                        zip(range(len(lat_deg)), lat_deg.tolist(), lon_deg.tolist()))
+        f.writelines('E,%d,%d,%s\n'%(u, v, name) for u, v in
+                        zip(np.asarray(src).tolist(), np.asarray(dst).tolist()))
 
 def counting_components(g):
     """
@@ -495,7 +814,64 @@ def counting_components(g):
 
     return len(buckets)
 
-def deserialize_graph(filename=DEFAULT_ROADS_PATH):
+def deserialize_graph(filename=DEFAULT_ROADS_PATH, edge_names=None,
+                      workers=None):
+    """
+    Returns (Graph, vertex_map) for the roads file. If edge_names is a
+    dictionary, or a RoadNames index, it is filled in with the street
+    name of every edge, in both directions.
+
+    If workers is given the file is parsed in that many processes (0 for
+    one per core) by read_city_graph_parallel; the result is the same.
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = os.path.join(d, 'roads.txt')
+    ...     write_roads_file(path, *random_grid_arrays(6, 7, seed=3))
+    ...     with open(path, 'a') as f:
+    ...         _ = f.write('E,0,1,Last\\nX,ignored\\nV,0,53.6,-113.3\\n')
+    ...     names, pnames = {}, {}
+    ...     g, vmap = deserialize_graph(path, names)
+    ...     h, hmap = deserialize_graph(path, pnames, workers=2)
+    >>> g._alist == h._alist, list(g._alist) == list(h._alist)
+    (True, True)
+    >>> vmap == hmap, list(vmap) == list(hmap), names == pnames
+    (True, True, True)
+    """
+    with hooks.span(hooks.GRAPH_LOAD, filename=filename):
+        if workers is not None:
+            return deserialize_graph_parallel(filename, edge_names, workers)
+        return deserialize_graph_internal(filename, edge_names)
+
+def deserialize_graph_parallel(filename, edge_names=None, workers=0):
+    arrays = read_city_graph_parallel(filename, workers or None)
+    vertices = arrays['ids'].tolist()
+    vertex_map = {
+        vId: {'id': vId, 'lat': lat, 'lon': lon}
+        for vId, lat, lon in zip(vertices, arrays['lats'].tolist(),
+                                 arrays['lons'].tolist())
+    }
+
+    starts, ends = arrays['starts'], arrays['ends']
+    if not np.isin(starts, arrays['ids']).all() or \
+            not np.isin(ends, arrays['ids']).all():
+        raise ValueError("an endpoint is not in graph")
+
+    # Both directions of each edge, interleaved as the serial loader
+    # adds them, so that every vertex lists its neighbours in the same
+    # order; from_arrays keeps that order.
+    src = np.column_stack((starts, ends)).ravel()
+    dst = np.column_stack((ends, starts)).ravel()
+    g = Graph.from_arrays(vertices, src, dst)
+
+    if edge_names is not None:
+        for start, end, name in zip(starts.tolist(), ends.tolist(),
+                                    arrays['names']):
+            edge_names[(start, end)] = edge_names[(end, start)] = name
+
+    return g, vertex_map
+
+def deserialize_graph_internal(filename, edge_names=None):
     sects = read_undirected_city_graph(filename)
     vx = sects.get('v', [])
     vertices = []
@@ -512,6 +888,9 @@ def deserialize_graph(filename=DEFAULT_ROADS_PATH):
         start, end = to_id(e_dict.get('start', -1)), to_id(e_dict.get('end', -1))
         edges.append((start, end,))
         edges.append((end, start,))
+        if edge_names is not None:
+            name = e_dict.get('name', '')
+            edge_names[(start, end)] = edge_names[(end, start)] = name
 
     return Graph(vertices, edges), vertex_map
 
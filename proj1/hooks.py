@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Profiling hooks. Code that does something worth profiling wraps it in
+#   with hooks.span(hooks.SEARCH, start=start, dest=dest):
+# and anyone can register begin/end callbacks for that region, e.g. to turn
+# a cProfile.Profile on and off, without patching the module itself.
+
+import doctest
+import tracemalloc
+
+GRAPH_LOAD   = 'graph.load'
+COST_MAP     = 'server.cost_map'
+SEARCH       = 'server.search'
+REQUEST      = 'repl.request'
+SERIAL_READ  = 'serial.read'
+SERIAL_WRITE = 'serial.write'
+
+REGIONS = (GRAPH_LOAD, COST_MAP, SEARCH, REQUEST, SERIAL_READ, SERIAL_WRITE)
+
+# region -> list of (begin, end) callback pairs
+_registry = {}
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ('region', 'info', 'callbacks')
+
+    def __init__(self, region, info, callbacks):
+        self.region = region
+        self.info = info
+        self.callbacks = callbacks
+
+    def __enter__(self):
+        for begin, _ in self.callbacks:
+            if begin is not None:
+                begin(self.region, self.info)
+        return self
+
+    def __exit__(self, *args):
+        for _, end in reversed(self.callbacks):
+            if end is not None:
+                end(self.region, self.info)
+        return False
+
+def register(region, begin=None, end=None):
+    """
+    Register callbacks run on entering and leaving every span of region.
+    Both are called as callback(region, info) where info is a dict of the
+    span's keyword arguments, shared between the two calls so that begin
+    can leave state for end.
+
+    Returns a handle for unregister.
+
+    >>> calls = []
+    >>> h = register(SEARCH, lambda r, i: calls.append(('begin', i['start'])),
+    ...                      lambda r, i: calls.append(('end', r)))
+    >>> with span(SEARCH, start=1):
+    ...     pass
+    >>> calls
+    [('begin', 1), ('end', 'server.search')]
+    >>> unregister(h)
+    >>> with span(SEARCH, start=2):
+    ...     pass
+    >>> len(calls)
+    2
+    >>> register('nowhere')
+    Traceback (most recent call last):
+        ...
+    ValueError: unknown hook region 'nowhere'
+    """
+    if region not in REGIONS:
+        raise ValueError("unknown hook region %r"%(region))
+
+    pair = (begin, end)
+    # Replace rather than mutate so that spans already running keep
+    # the callbacks they started with.
+    _registry[region] = _registry.get(region, []) + [pair]
+    return region, pair
+
+def unregister(handle):
+    region, pair = handle
+    remaining = [p for p in _registry.get(region, []) if p is not pair]
+    if remaining:
+        _registry[region] = remaining
+    else:
+        _registry.pop(region, None)
+
+def clear():
+    _registry.clear()
+
+def span(region, **info):
+    """
+    Context manager around one occurrence of region. When nothing is
+    registered for the region this is a dictionary lookup.
+
+    >>> with span(GRAPH_LOAD, filename='roads.txt') as s:
+    ...     pass
+    """
+    callbacks = _registry.get(region)
+    if not callbacks:
+        return _NULL_SPAN
+    return _Span(region, info, callbacks)
+
+def attach_profiler(profiler, *regions):
+    """
+    Enable profiler (a cProfile.Profile) only inside the given regions.
+    Returns the handles to unregister.
+
+    >>> import cProfile, pstats, io
+    >>> prof = cProfile.Profile()
+    >>> handles = attach_profiler(prof, SEARCH)
+    >>> with span(SEARCH):
+    ...     _ = sorted(range(10))
+    >>> for h in handles:
+    ...     unregister(h)
+    >>> out = io.StringIO()
+    >>> _ = pstats.Stats(prof, stream=out).print_stats()
+    >>> 'sorted' in out.getvalue()
+    True
+    """
+    return [register(region, lambda r, i: profiler.enable(),
+                             lambda r, i: profiler.disable())
+                for region in regions]
+
+def attach_tracemalloc(peaks, *regions):
+    """
+    Record in peaks[region] the largest peak of traced memory seen
+    inside any span of the given regions.
+
+    >>> peaks = {}
+    >>> handles = attach_tracemalloc(peaks, COST_MAP)
+    >>> with span(COST_MAP):
+    ...     _ = [0] * 100000
+    >>> for h in handles:
+    ...     unregister(h)
+    >>> peaks[COST_MAP] >= 800000
+    True
+    """
+    def begin(region, info):
+        info['tracemalloc_started'] = not tracemalloc.is_tracing()
+        if info['tracemalloc_started']:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    def end(region, info):
+        peak = tracemalloc.get_traced_memory()[1]
+        peaks[region] = max(peaks.get(region, 0), peak)
+        if info.pop('tracemalloc_started'):
+            tracemalloc.stop()
+
+    return [register(region, begin, end) for region in regions]
+
+if __name__ == '__main__':
+    doctest.testmod()
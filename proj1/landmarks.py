@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# ALT (A*, Landmarks, Triangle inequality) lower bounds.
+#
+# For a landmark L and any vertices v, t the triangle inequality gives
+#     d(v, t) >= d(L, t) - d(L, v)    and    d(v, t) >= d(v, L) - d(t, L)
+# so with distances to and from a few well spread landmarks precomputed,
+# the best of these bounds is an A* heuristic. Unlike straight-line
+# distance it knows about rivers: a vertex across the river from the
+# target is far from it through any landmark on the other bank.
+
+import os
+import doctest
+import hashlib
+
+import numpy as np
+
+# Local modules
+from .coord_store import replacing
+from .partition import dijkstra
+
+# Distances are stored as float32 to halve the tables; bounds are lowered
+# by this fraction of the largest distance to absorb the rounding.
+SLACK = 2.0 ** -20
+
+def reverse_adjacency(graph):
+    """
+    >>> from .graph_v2 import Graph
+    >>> reverse_adjacency(Graph({1, 2, 3}, [(1, 2), (3, 2)]))[2]
+    [1, 3]
+    """
+    radj = {v: [] for v in graph.vertices()}
+    src, dst = graph.edge_arrays()
+    for u, v in zip(src.tolist(), dst.tolist()):
+        radj[v].append(u)
+    return radj
+
+def graph_fingerprint(graph, cost, source_path=None):
+    """
+    What saved tables are checked against before they are used: the
+    vertex and edge counts of graph, the modification time of the file
+    it was read from, if any, and a digest of every edge's cost. The
+    digest tells apart tables built with another metric, fixed-point
+    scale or set of closures, whose bounds would not be lower bounds.
+
+    >>> from .graph_v2 import Graph
+    >>> g = Graph({1, 2, 3}, [(1, 2), (3, 2)])
+    >>> graph_fingerprint(g, lambda e: 1.0)[:3]
+    (3, 2, 0.0)
+    >>> (graph_fingerprint(g, lambda e: 1.0) ==
+    ...  graph_fingerprint(g, lambda e: 2.0))
+    False
+    """
+    src, dst = graph.edge_arrays()
+    costs = np.array([cost(e) for e in zip(src.tolist(), dst.tolist())],
+                     dtype='<f8')
+    mtime = os.path.getmtime(source_path) if source_path is not None else 0.0
+    digest = hashlib.sha1(costs.tobytes()).hexdigest()
+    return len(graph.vertices()), len(src), mtime, digest
+
+def distance_row(index, dist):
+    row = np.full(len(index), np.inf, dtype=np.float32)
+    for v, d in dist.items():
+        row[index[v]] = d
+    return row
+
+class Landmarks:
+    """
+    Distance tables between k landmarks and every vertex.
+
+    Args:
+        ids: Vertex ids, one per table column.
+        landmarks: The landmark vertex ids.
+        dist_from: float32 array, dist_from[i, k] = d(landmarks[k], ids[i]).
+        dist_to: float32 array, dist_to[i, k] = d(ids[i], landmarks[k]).
+    """
+    def __init__(self, ids, landmarks, dist_from, dist_to):
+        self.ids = np.asarray(ids)
+        self.landmarks = list(landmarks)
+        self.dist_from = np.asarray(dist_from, dtype=np.float32)
+        self.dist_to = np.asarray(dist_to, dtype=np.float32)
+        self.__index = {v: i for i, v in enumerate(self.ids.tolist())}
+
+        finite = np.concatenate((self.dist_from[np.isfinite(self.dist_from)],
+                                 self.dist_to[np.isfinite(self.dist_to)]))
+        self.__slack = float(finite.max()) * SLACK if len(finite) else 0.0
+
+    @classmethod
+    def build(cls, graph, cost, k=8, seed=None):
+        """
+        Pick k landmarks by farthest-point selection, each one the vertex
+        whose distance to the landmarks chosen so far is largest, and
+        compute the distance tables with two searches per landmark.
+
+        >>> from .graph_v2 import graph_from_arrays, random_grid_arrays
+        >>> from .server import Server
+        >>> g, vmap = graph_from_arrays(*random_grid_arrays(6, 6, seed=9))
+        >>> srv = Server(g, vmap)
+        >>> lm = Landmarks.build(g, srv.edge_cost, k=3, seed=1)
+        >>> len(lm.landmarks), lm.dist_from.shape, lm.dist_from.dtype
+        (3, (36, 3), dtype('float32'))
+        """
+        ids = sorted(graph.vertices())
+        index = {v: i for i, v in enumerate(ids)}
+        n = len(ids)
+        k = min(k, n)
+        radj = reverse_adjacency(graph)
+
+        forward = lambda v: [(u, cost((v, u))) for u in graph.neighbours(v)]
+        backward = lambda v: [(u, cost((u, v))) for u in radj[v]]
+
+        rng = np.random.default_rng(seed)
+        dist_from = np.full((n, k), np.inf, dtype=np.float32)
+        dist_to = np.full((n, k), np.inf, dtype=np.float32)
+        nearest = np.full(n, np.inf)
+        landmarks = []
+        candidate = ids[int(rng.integers(n))] if n else None
+
+        for j in range(k):
+            if landmarks:
+                # Unreached vertices count as nearby, so that landmarks are
+                # spread over the component the others live in.
+                score = np.where(np.isfinite(nearest), nearest, -1)
+                score[[index[L] for L in landmarks]] = -1
+                candidate = ids[int(np.argmax(score))]
+
+            landmarks.append(candidate)
+            dist_from[:, j] = distance_row(index,
+                                           dijkstra(forward, candidate)[0])
+            dist_to[:, j] = distance_row(index,
+                                         dijkstra(backward, candidate)[0])
+            nearest = np.minimum(nearest, dist_from[:, j])
+
+        return cls(ids, landmarks, dist_from, dist_to)
+
+    def heuristic(self, dest):
+        """
+        Returns h(v), a lower bound on the cost from v to dest.
+
+        >>> from .graph_v2 import graph_from_arrays, random_grid_arrays
+        >>> from .server import Server
+        >>> g, vmap = graph_from_arrays(*random_grid_arrays(8, 8, seed=3))
+        >>> srv = Server(g, vmap)
+        >>> lm = Landmarks.build(g, srv.edge_cost, k=4, seed=2)
+        >>> h = lm.heuristic(63)
+        >>> path = srv.least_cost_path(0, 63, srv.edge_cost)
+        >>> exact = sum(map(srv.edge_cost, zip(path, path[1:])))
+        >>> 0 < h(0) <= exact, h(63)
+        (True, 0.0)
+        """
+        t = self.__index.get(dest)
+        if t is None:
+            return lambda v: 0.0
+
+        from_t = self.dist_from[t].astype(np.float64)
+        to_t = self.dist_to[t].astype(np.float64)
+        index, dist_from, dist_to = self.__index, self.dist_from, self.dist_to
+        slack = self.__slack
+        cache = {}
+
+        def h(v):
+            bound = cache.get(v)
+            if bound is None:
+                i = index.get(v)
+                if i is None:
+                    bound = 0.0
+                else:
+                    with np.errstate(invalid='ignore'):
+                        bounds = np.concatenate((from_t - dist_from[i],
+                                                 dist_to[i] - to_t))
+                    # inf - inf is nan: no information from that landmark
+                    bounds = bounds[~np.isnan(bounds)]
+                    best = float(bounds.max()) if len(bounds) else 0.0
+                    bound = max(0.0, best - slack) if best != np.inf else best
+                cache[v] = bound
+            return bound
+
+        return h
+
+    def save(self, filename, fingerprint):
+        """
+        Write the tables to filename along with the graph_fingerprint of
+        the graph they were built for.
+
+        >>> import tempfile
+        >>> lm = Landmarks([1, 2], [2], [[1.5], [0]], [[1.5], [0]])
+        >>> with tempfile.TemporaryDirectory() as d:
+        ...     lm.save(os.path.join(d, 'alt.npz'), (2, 1, 0.0, 'ab12'))
+        ...     back, fingerprint = Landmarks.load(os.path.join(d, 'alt.npz'))
+        >>> back.landmarks, back.dist_from.tolist(), fingerprint
+        ([2], [[1.5], [0.0]], (2, 1, 0.0, 'ab12'))
+        """
+        n, m, mtime, digest = fingerprint
+        # Through a file object, np.savez leaves the name as it is
+        with replacing(filename) as f:
+            np.savez(f, ids=self.ids, landmarks=np.array(self.landmarks),
+                     dist_from=self.dist_from, dist_to=self.dist_to,
+                     counts=np.array([n, m], dtype=np.int64),
+                     mtime=np.float64(mtime), cost_digest=np.str_(digest))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Returns (landmarks, fingerprint) as written by save.
+        """
+        with np.load(filename) as data:
+            n, m = data['counts'].tolist()
+            return (cls(data['ids'], data['landmarks'].tolist(),
+                        data['dist_from'], data['dist_to']),
+                    (n, m, float(data['mtime']), str(data['cost_digest'])))
+
+def open_landmarks(filename, graph, cost, source_path=None, k=8, seed=None):
+    """
+    Load the tables saved in filename, first (re)building and saving
+    them if the file is missing, unreadable or was saved for a graph
+    with another graph_fingerprint. Tables saved for another graph would
+    give bounds that are not lower bounds, and wrong routes with them.
+
+    >>> import tempfile
+    >>> from .graph_v2 import graph_from_arrays, random_grid_arrays
+    >>> from .server import Server
+    >>> g, vmap = graph_from_arrays(*random_grid_arrays(4, 4, seed=1))
+    >>> h, hmap = graph_from_arrays(*random_grid_arrays(5, 5, seed=1))
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = os.path.join(d, 'alt.bin')
+    ...     a = open_landmarks(path, g, Server(g, vmap).edge_cost, k=2)
+    ...     b = open_landmarks(path, g, Server(g, vmap).edge_cost, k=3)
+    ...     c = open_landmarks(path, h, Server(h, hmap).edge_cost, k=3)
+    ...     os.listdir(d)
+    ['alt.bin']
+    >>> len(b.landmarks), len(c.landmarks), len(c.ids)
+    (2, 3, 25)
+
+    Tables built with other costs for the same graph are rebuilt too:
+
+    >>> with tempfile.TemporaryDirectory() as d:
+    ...     path = os.path.join(d, 'alt.bin')
+    ...     fixed = Server(g, vmap, fixed_point=16).edge_cost
+    ...     a = open_landmarks(path, g, fixed, k=2, seed=0)
+    ...     b = open_landmarks(path, g, Server(g, vmap).edge_cost, k=2, seed=0)
+    >>> bool(b.dist_from.max() < a.dist_from.max())
+    True
+    """
+    fingerprint = graph_fingerprint(graph, cost, source_path)
+    try:
+        landmarks, saved = Landmarks.load(filename)
+        if saved == fingerprint:
+            return landmarks
+    except (OSError, ValueError, KeyError):
+        pass
+
+    landmarks = Landmarks.build(graph, cost, k=k, seed=seed)
+    landmarks.save(filename, fingerprint)
+    return landmarks
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# The client's map tiles, mirrored from proj2/map.cpp, so that the server
+# can turn waypoints into the same pixel positions the Arduino would compute
+# with longitude_to_x and latitude_to_y, and send those instead.
+
+import doctest
+
+import numpy as np
+
+# (N, W, S, E) corners of each tile, in hundred-thousandths of a degree;
+# must match map_box in proj2/map.cpp.
+MAP_BOX = (
+    (5364463, -11373047, 5343572, -11337891),    # map 0 zoom 11
+    (5364464, -11373047, 5343572, -11337891),    # map 1 zoom 12
+    (5361858, -11368652, 5340953, -11333496),    # map 2 zoom 13
+    (5360554, -11368652, 5339643, -11333496),    # map 3 zoom 14
+    (5360554, -11367554, 5339643, -11332397),    # map 4 zoom 15
+    (5360228, -11367554, 5339316, -11332397),    # map 5 zoom 16
+)
+
+# Largest pixel position on each tile, map_x_limit and map_y_limit.
+MAP_X_LIMIT = (511, 1023, 2047, 4095, 8191, 16383)
+MAP_Y_LIMIT = (511, 1023, 2047, 4095, 8191, 16383)
+
+NUM_MAPS = len(MAP_BOX)
+
+def arduino_map(x, in_min, in_max, out_min, out_max):
+    """
+    Vectorized Arduino map(): integer arithmetic with the division
+    truncated towards zero, as in C.
+
+    >>> arduino_map(np.array([5, -5, 10]), 0, 10, 0, 3).tolist()
+    [1, -1, 3]
+    """
+    num = (np.asarray(x, dtype=np.int64) - in_min) * (out_max - out_min)
+    den = in_max - in_min
+    quot = np.abs(num) // abs(den)
+    return np.where((num < 0) != (den < 0), -quot, quot) + out_min
+
+def check_map_num(map_num):
+    if not 0 <= map_num < NUM_MAPS:
+        raise ValueError("map number %r is not in [0, %d)"%(map_num, NUM_MAPS))
+
+def longitude_to_x(map_num, lon):
+    check_map_num(map_num)
+    _, west, _, east = MAP_BOX[map_num]
+    return arduino_map(lon, west, east, 0, MAP_X_LIMIT[map_num])
+
+def latitude_to_y(map_num, lat):
+    check_map_num(map_num)
+    north, _, south, _ = MAP_BOX[map_num]
+    return arduino_map(lat, north, south, 0, MAP_Y_LIMIT[map_num])
+
+def project(map_num, lats, lons):
+    """
+    Pixel positions of the points on tile map_num, as two int64 arrays.
+
+    >>> xs, ys = project(0, [5364463, 5343572], [-11373047, -11337891])
+    >>> xs.tolist(), ys.tolist()
+    ([0, 511], [0, 511])
+    """
+    return longitude_to_x(map_num, lons), latitude_to_y(map_num, lats)
+
+def pixel_deltas(xs, ys):
+    """
+    The first pixel position followed by the step to each next one, which
+    along a road is only a few pixels and so a few bytes on the wire.
+
+    >>> pixel_deltas(np.array([100, 103, 103]), np.array([7, 5, 9]))
+    [(100, 7), (3, -2), (0, 4)]
+    """
+    if not len(xs):
+        return []
+    dxs = np.diff(xs, prepend=0)
+    dys = np.diff(ys, prepend=0)
+    return list(zip(dxs.tolist(), dys.tolist()))
+
+def simplify(xs, ys, tolerance=1):
+    """
+    Douglas-Peucker: indices of the points to keep so that no dropped
+    point is more than tolerance pixels from the line through the kept
+    points on either side of it. The ends are always kept.
+
+    >>> xs = np.array([0, 1, 2, 3, 4, 4, 4])
+    >>> ys = np.array([0, 0, 1, 0, 0, 3, 6])
+    >>> simplify(xs, ys).tolist(), simplify(xs, ys, tolerance=0.5).tolist()
+    ([0, 4, 6], [0, 2, 4, 6])
+    """
+    n = len(xs)
+    if n < 3:
+        return np.arange(n)
+
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        lo, hi = stack.pop()
+        if hi - lo < 2:
+            continue
+        dx, dy = xs[hi] - xs[lo], ys[hi] - ys[lo]
+        px, py = xs[lo+1:hi] - xs[lo], ys[lo+1:hi] - ys[lo]
+        length = np.hypot(dx, dy)
+        if length:
+            dist = np.abs(px * dy - py * dx) / length
+        else:
+            dist = np.hypot(px, py)
+
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            mid = lo + 1 + k
+            keep[mid] = True
+            stack.append((lo, mid))
+            stack.append((mid, hi))
+
+    return np.flatnonzero(keep)
+
+def detail_level(map_num, lats, lons, tolerance=1):
+    """
+    Indices of the waypoints worth sending to a client showing map
+    map_num: the rest are within tolerance pixels of the line drawn
+    through them, so on a zoomed out map most of a route falls away.
+    """
+    return simplify(*project(map_num, lats, lons), tolerance=tolerance)
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Two-level partitioning for long queries on large road networks.
+#
+# Offline, the vertices are split into a grid of cells. A vertex with an
+# edge to or from another cell is a boundary vertex, and for every cell we
+# store the shortest in-cell distance between each pair of its boundary
+# vertices, leaving out those that are just two shorter shortcuts in a
+# row. These "shortcut" edges plus the edges that cross cells form the
+# overlay graph.
+#
+# A query from s to t then searches every edge of the cells of s and t but
+# only the overlay inside all other cells. Any path through another cell
+# enters and leaves it at boundary vertices, and the shortcut between them
+# is never longer than that stretch, so the search finds the same least
+# cost as a plain search over the whole graph; shortcuts on the winning
+# path are expanded back into road vertices by small in-cell searches.
+
+import doctest
+
+import numpy as np
+
+# Local modules
+from .binary_heap import BinaryHeap
+from .coord_store import coordinate_arrays, lookup_coordinates
+
+INF = float('inf')
+
+def dijkstra(neighbours, start, targets=None, limit=None):
+    """
+    Least cost search from start, where neighbours(v) yields (u, cost)
+    pairs. Stops once every vertex in targets is settled, if given, and
+    before settling any vertex further away than limit.
+
+    Returns (dist, parent) dictionaries over the settled vertices, with
+    parent[start] == start.
+
+    >>> adj = {1: [(2, 7), (3, 9)], 2: [(3, 1)], 3: []}
+    >>> dist, parent = dijkstra(lambda v: adj[v], 1)
+    >>> dist == {1: 0, 2: 7, 3: 8}, parent[3]
+    (True, 2)
+    >>> sorted(dijkstra(lambda v: adj[v], 1, targets={1})[0])
+    [1]
+    >>> sorted(dijkstra(lambda v: adj[v], 1, limit=7)[0])
+    [1, 2]
+    """
+    dist = {}
+    parent = {}
+    remaining = None if targets is None else set(targets)
+
+    PQ = BinaryHeap()
+    PQ.add((start, start), 0)
+    while len(PQ):
+        (prev, curr), d = PQ.pop_min()
+        if curr in dist:
+            continue
+        if limit is not None and d > limit:
+            break
+
+        dist[curr] = d
+        parent[curr] = prev
+        if remaining is not None:
+            remaining.discard(curr)
+            if not remaining:
+                break
+
+        for nb, w in neighbours(curr):
+            # Infinite costs are closed roads, not edges
+            if nb not in dist and w != INF:
+                PQ.add((curr, nb), d + w)
+
+    return dist, parent
+
+def walk_back(parent, start, dest):
+    """
+    >>> walk_back({1: 1, 2: 1, 3: 2}, 1, 3)
+    [1, 2, 3]
+    >>> walk_back({1: 1}, 1, 3)
+    []
+    """
+    if dest not in parent:
+        return []
+
+    walk = [dest]
+    while dest != start:
+        dest = parent[dest]
+        walk.append(dest)
+
+    walk.reverse()
+    return walk
+
+def grid_cells(vertex_map, vertices, cells_per_side):
+    """
+    Assign each vertex to one of cells_per_side**2 cells. Cell borders
+    sit at coordinate quantiles so that cells hold similar numbers of
+    vertices even where the network is uneven.
+
+    >>> vmap = {v: dict(id=v, lat=v // 4, lon=v % 4) for v in range(16)}
+    >>> cells = grid_cells(vmap, range(16), 2)
+    >>> [cells[v] for v in (0, 3, 12, 15)]
+    [0, 1, 2, 3]
+    """
+    ids = np.array(list(vertices))
+    lats, lons = lookup_coordinates(coordinate_arrays(vertex_map), ids)
+    qs = np.linspace(0, 1, cells_per_side + 1)[1:-1]
+    rows = np.searchsorted(np.quantile(lats, qs), lats, side='right')
+    cols = np.searchsorted(np.quantile(lons, qs), lons, side='right')
+
+    return dict(zip(ids.tolist(), (rows * cells_per_side + cols).tolist()))
+
+class Partition:
+    """
+    A partitioned view of graph with precomputed boundary distances.
+
+    Args:
+        graph (Graph): The road network.
+        cost: Function from an edge to its cost, as for least_cost_path.
+        cell_of (dict): Maps every vertex to a cell id, e.g. grid_cells.
+        shortcuts: Precomputed (src, dst, weight) arrays from a previous
+            Partition's shortcut_arrays(); computed when omitted.
+    """
+    def __init__(self, graph, cost, cell_of, shortcuts=None):
+        self.__graph = graph
+        self.__cost = cost
+        self.__cell_of = cell_of
+
+        src, dst = graph.edge_arrays()
+        boundary = set()
+        self.__cut = {}
+        for u, v in zip(src.tolist(), dst.tolist()):
+            if cell_of[u] != cell_of[v]:
+                boundary.add(u)
+                boundary.add(v)
+                self.__cut.setdefault(u, []).append((v, cost((u, v))))
+
+        self.__boundary = {}
+        for b in boundary:
+            self.__boundary.setdefault(cell_of[b], []).append(b)
+
+        self.__shortcuts = {}
+        if shortcuts is None:
+            for cell in self.__boundary:
+                self.__build_cell(cell)
+        else:
+            for u, v, w in zip(*(np.asarray(a).tolist() for a in shortcuts)):
+                self.__shortcuts.setdefault(u, []).append((v, w))
+
+    def __in_cell(self, cell):
+        cell_of, cost = self.__cell_of, self.__cost
+        def neighbours(v):
+            return [(u, cost((v, u))) for u in self.__graph.neighbours(v)
+                        if cell_of[u] == cell]
+        return neighbours
+
+    def __build_cell(self, cell):
+        members = self.__boundary[cell]
+        is_member = set(members)
+        neighbours = self.__in_cell(cell)
+        for b in members:
+            dist, parent = dijkstra(neighbours, b, members)
+
+            # A shortcut whose in-cell path passes another boundary vertex
+            # is the sum of two other shortcuts, so it is left out. dist is
+            # in settling order, so every parent is seen before its child.
+            passes = {b: False}
+            for v in dist:
+                if v != b:
+                    p = parent[v]
+                    passes[v] = passes[p] or (p != b and p in is_member)
+
+            self.__shortcuts[b] = [(u, dist[u]) for u in members
+                                    if u != b and u in dist and not passes[u]]
+
+    def update_edges(self, edges):
+        """
+        Bring the partition up to date after the costs of edges changed.
+        Cut edges have their cached cost refreshed and every cell with a
+        changed edge inside it has its shortcuts recomputed; all other
+        cells are untouched.
+
+        Returns the set of rebuilt cells.
+        """
+        cell_of, cost = self.__cell_of, self.__cost
+        dirty = set()
+        refresh = set()
+        for u, v in edges:
+            if cell_of[u] == cell_of[v]:
+                dirty.add(cell_of[u])
+            else:
+                refresh.add(u)
+
+        for u in refresh:
+            self.__cut[u] = [(v, cost((u, v))) for v, _ in self.__cut[u]]
+
+        for cell in dirty:
+            if cell in self.__boundary:
+                self.__build_cell(cell)
+
+        return dirty
+
+    def cell_of(self, v):
+        return self.__cell_of[v]
+
+    def shortcut_arrays(self):
+        """
+        The shortcuts as (src, dst, weight) arrays, for saving next to
+        the graph and passing back in as shortcuts.
+        """
+        triples = [(u, v, w) for u, edges in self.__shortcuts.items()
+                        for v, w in edges]
+        if not triples:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+        src, dst, weight = zip(*triples)
+        return np.array(src), np.array(dst), np.array(weight, np.float64)
+
+    def boundary_count(self):
+        return sum(len(members) for members in self.__boundary.values())
+
+    def least_cost_path(self, start, dest):
+        """
+        Least cost path from start to dest, searching all edges of their
+        two cells and only the overlay elsewhere.
+
+        >>> from .graph_v2 import graph_from_arrays, random_grid_arrays
+        >>> from .server import Server
+        >>> g, vmap = graph_from_arrays(*random_grid_arrays(12, 12, seed=4))
+        >>> srv = Server(g, vmap)
+        >>> part = Partition(g, srv.edge_cost, grid_cells(vmap, g.vertices(), 3))
+        >>> import random
+        >>> rng = random.Random(36)
+        >>> path_cost = lambda p: sum(map(srv.edge_cost, zip(p, p[1:])))
+        >>> for _ in range(50):
+        ...     s, t = rng.randrange(144), rng.randrange(144)
+        ...     plain = srv.least_cost_path(s, t, srv.edge_cost)
+        ...     fast = part.least_cost_path(s, t)
+        ...     assert (plain == []) == (fast == [])
+        ...     assert abs(path_cost(plain) - path_cost(fast)) < 1e-6
+        ...     assert fast == [] or (fast[0], fast[-1]) == (s, t)
+        """
+        graph = self.__graph
+        if not (graph.is_vertex(start) and graph.is_vertex(dest)):
+            return []
+
+        cell_of, cost = self.__cell_of, self.__cost
+        local = (cell_of[start], cell_of[dest])
+
+        def neighbours(v):
+            if cell_of[v] in local:
+                return [(u, cost((v, u))) for u in graph.neighbours(v)]
+            return self.__shortcuts.get(v, []) + self.__cut.get(v, [])
+
+        _, parent = dijkstra(neighbours, start, {dest})
+        overlay_path = walk_back(parent, start, dest)
+
+        path = overlay_path[:1]
+        for u, v in zip(overlay_path, overlay_path[1:]):
+            cell = cell_of[u]
+            if cell == cell_of[v] and cell not in local:
+                _, inner = dijkstra(self.__in_cell(cell), u, {v})
+                path.extend(walk_back(inner, u, v)[1:])
+            else:
+                path.append(v)
+
+        return path
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -1,23 +1,29 @@
 #!/usr/bin/env python3
 
 import sys
+import math
 import base64
 import doctest
 
+import numpy as np
+
 # Local module
-from .server import (
-    cost,
-    create_server,
+from .server import create_server
+from .stats import NULL_STATS
+from . import hooks
+from . import map_tiles
+from .request_queue import QueueFull, Superseded
+from .response_cache import EncodedRoute, ResponseCache
+from .defs import (
+    Acknowledgement,
+    Comment,
+    DetailLevel,
+    EndOfSession,
+    Request,
+    StartOfSession,
+    Unknown,
 )
 
-Acknowledgement = 'A'
-StartOfSession  = 'starting'
-EndOfSession    = 'E'
-Request         = 'R'
-WayPoint        = 'W'
-Unknown         = 'U'
-Comment         = '#'
-
 def is_callable_attr(obj, attr):
     """
     >>> class F:
@@ -44,10 +50,54 @@ def preprocess_line(line):
 def non_empty_fields(splits):
     return [field for field in splits if field]
 
+def parse_coordinate(field):
+    """
+    A coordinate field of a request, in integer hundred-thousandths of a
+    degree; a fractional one is rounded.
+
+    >>> parse_coordinate('5365486'), parse_coordinate('-11333915.6')
+    (5365486, -11333916)
+    """
+    try:
+        return int(field)
+    except ValueError:
+        return round(float(field))
+
 class Repl:
-    def __init__(self, server, vertex_map, stdin=None, stdout=None):
+    """
+    Args:
+        pixels (bool): When a request carries the client's map number
+            as a fifth field, answer with pixel positions on that map
+            tile, the first as 'P x y' and each later one as the step
+            'D dx dy' from the one before, instead of 'W lat lon' lines.
+        levels (bool): When a request carries the client's map number,
+            first send only the waypoints that show on that map tile,
+            and resend the last route in more detail on 'L n', the
+            request for detail level (map number) n. These replies
+            start 'N count level', so the client knows it may ask.
+        queue (RequestQueue): Searches go through this queue, shared
+            with the other sessions using server, when given.
+        session: This session's key in queue; defaults to the Repl.
+        responses (ResponseCache): Encoded replies to reuse when the
+            same route is sent again; by default each Repl keeps its own.
+    """
+    def __init__(self, server, vertex_map, stdin=None, stdout=None,
+                 stats=None, pixels=False, levels=False, queue=None,
+                 session=None, responses=None):
         self.__server = server
+        self.__queue = queue
+        self.__session = self if session is None else session
         self.__vertex_map = vertex_map
+        self.__stats = stats or getattr(server, 'stats', NULL_STATS)
+        if responses is None:
+            responses = ResponseCache(stats=self.__stats)
+        self.__responses = responses
+        self.__pixels = pixels
+        self.__levels = levels
+
+        # The last route sent and its waypoints per detail level
+        self.__route = []
+        self.__route_levels = {}
 
         self.__eos = False
         self.__stdin = stdin or sys.stdin
@@ -60,15 +110,18 @@ class Repl:
         return self.__stdout.write(content+'\n')
 
     def readline(self):
-        try:
-            df = self.__stdin.readline()
-        except Exception as e:
-            print(e)
-            return ''
-        else:
+        # Comment lines are skipped in a loop: however chatty the client,
+        # the stack does not grow.
+        while 1:
+            try:
+                df = self.__stdin.readline()
+            except Exception as e:
+                print(e)
+                return ''
+
             if df and df[0] == Comment:
                 print(df)
-                return self.readline()
+                continue
 
             #print(df)
             return df
@@ -83,35 +136,130 @@ class Repl:
             self.__eos = True
         elif head == Request:
             self.parse_request(parsed)
+        elif head == DetailLevel:
+            self.parse_detail_level(parsed)
 
         return head, rest
 
     def parse_request(self, data):
-        head, *rest = data
-        least_cost_path_ids = self.parse_least_cost_path(*rest)
-        # print("\033[47midsLen\033[00m", len(least_cost_path_ids))
+        stats = self.__stats
+        with stats.phase('request'), hooks.span(hooks.REQUEST, request=data):
+            head, *rest = data
+            map_num = self.parse_map_num(rest[4:])
+            least_cost_path_ids = self.parse_least_cost_path(*rest[:4])
+            # print("\033[47midsLen\033[00m", len(least_cost_path_ids))
+
+            level = None
+            if self.__levels and map_num is not None:
+                self.__route = least_cost_path_ids
+                self.__route_levels = {}
+                least_cost_path_ids = self.route_at_level(map_num)
+                level = map_num
+
+            with stats.phase('send'):
+                self.send_route(least_cost_path_ids, map_num, level)
+
+        stats.incr('requests')
+        stats.incr('waypoints', len(least_cost_path_ids))
+        stats.tick()
+
+    def parse_detail_level(self, data):
+        """
+        'L n': resend the last route with the detail needed on map n.
+        """
+        map_num = self.parse_map_num(data[1:])
+        way_ids = []
+        if map_num is not None:
+            way_ids = self.route_at_level(map_num)
+
+        with self.__stats.phase('send'):
+            self.send_route(way_ids, map_num, map_num)
+        self.__stats.incr('waypoints', len(way_ids))
+
+    def route_at_level(self, map_num):
+        """
+        The waypoints of the last route that show on map map_num,
+        simplified once per level and then kept.
+        """
+        way_ids = self.__route_levels.get(map_num)
+        if way_ids is None:
+            route = [way_id for way_id in self.__route
+                        if self.way_point_coords(way_id) is not None]
+            lats, lons = zip(*map(self.way_point_coords, route)) \
+                            if route else ((), ())
+            keep = map_tiles.detail_level(map_num, lats, lons)
+            way_ids = self.__route_levels[map_num] = \
+                            [route[i] for i in keep.tolist()]
+        return way_ids
+
+    def send_route(self, way_ids, map_num=None, level=None):
+        if not self.__pixels:
+            map_num = None
+
+        key = (tuple(way_ids), map_num, level)
+        route = self.__responses.get(key)
+        if route is None:
+            route = self.encode_route(way_ids, map_num, level)
+            self.__responses.put(key, route)
+
+        lines = route.lines()
+        self.writeline(next(lines))
+        for outLine in lines:
+            if not self.send_line(outLine):
+                print("Failed to get a response", outLine)
+                break
 
-        fmt = 'N %d'%(len(least_cost_path_ids))
-        self.writeline(fmt)
+        self.send_eos()
 
-        for way_id in least_cost_path_ids:
-            if not self.send_way_point(way_id):
-                print("Failed to get a response", way_id)
+    def encode_route(self, way_ids, map_num=None, level=None):
+        """
+        The reply for way_ids; waypoints after one with unknown
+        coordinates are left out, though the header still counts them.
+        """
+        coords = []
+        for way_id in way_ids:
+            retr = self.way_point_coords(way_id)
+            if retr is None:
+                print("No coordinates for", way_id)
                 break
+            coords.append(retr)
 
-            print(way_id)
-
-        self.send_eos()
+        lats = [lat for lat, _ in coords]
+        lons = [lon for _, lon in coords]
+        return EncodedRoute.encode(lats, lons, map_num, count=len(way_ids),
+                                   level=level)
 
     def send_eos(self):
         self.writeline(EndOfSession)
 
-    def send_way_point(self, way_id):
+    def parse_map_num(self, extra):
+        """
+        The map number of a request in pixel or levels mode, None
+        otherwise.
+        """
+        if not ((self.__pixels or self.__levels) and extra):
+            return None
+        try:
+            map_num = int(extra[0])
+            map_tiles.check_map_num(map_num)
+        except ValueError as e:
+            print(e)
+            return None
+        return map_num
+
+    def way_point_coords(self, way_id):
+        """
+        (lat, lon) of a waypoint: a vertex id or an already snapped
+        (lat, lon) tuple. None if the vertex is unknown.
+        """
+        if isinstance(way_id, tuple):
+            return way_id
         retr = self.__vertex_map.get(way_id, None)
         if retr is None:
-            return False
-        lat, lon = retr['lat'], retr['lon']
-        outLine = '%s %d %d'%(WayPoint, lat, lon)
+            return None
+        return retr['lat'], retr['lon']
+
+    def send_line(self, outLine):
         print(outLine, self.writeline(outLine))
 
         _, ok = self.parse_ack()
@@ -119,7 +267,9 @@ class Repl:
         return ok
 
     def parse_ack(self):
-        symlist = preprocess_line(self.readline())
+        with self.__stats.phase('ack'):
+            line = self.readline()
+        symlist = preprocess_line(line)
         symbol = Unknown
         if len(symlist) >= 1:
             symbol = symlist[0]
@@ -128,6 +278,19 @@ class Repl:
         return symbol, symbol == Acknowledgement
         # return symbol, True
 
+    def pending_lines(self):
+        """
+        Lines already received but not yet read, if the input can tell.
+        """
+        pending = getattr(self.__stdin, 'pending_lines', None)
+        return pending() if pending is not None else []
+
+    def at_eof(self):
+        """
+        True once the input has been closed and all of it has been read.
+        """
+        return getattr(self.__stdin, 'eof', False)
+
     def read_evaluate(self):
         return self.evaluate(self.readline())
 
@@ -141,30 +304,120 @@ class Repl:
         return v.lower().find(StartOfSession) == 0
 
     def parse_least_cost_path(self, *fields):
-        x_lat, x_lon, y_lat, y_lon = fields
-        start_min_dist, start_min_point =\
-                        self.closest_point(float(x_lat), float(x_lon))
-        end_min_dist, end_min_point  =\
-                        self.closest_point(float(y_lat), float(y_lon))
+        x_lat, x_lon, y_lat, y_lon = map(parse_coordinate, fields)
+        if self.__server.segment_index() is not None:
+            return self.parse_snapped_path(x_lat, x_lon, y_lat, y_lon)
+
+        with self.__stats.phase('snap'):
+            start_min_dist, start_min_point =\
+                            self.closest_point(x_lat, x_lon)
+            end_min_dist, end_min_point  =\
+                            self.closest_point(y_lat, y_lon)
         start_id, end_id =\
                      start_min_point.get('id', -1), end_min_point.get('id', -1)
 
-        return self.__server.least_cost_path_internal(start_id, end_id)
+        with self.__stats.phase('search'):
+            return self.search(('path', start_id, end_id),
+                lambda: self.__server.least_cost_path_internal(start_id,
+                                                               end_id), [])
+
+    def search(self, key, compute, failed):
+        """
+        compute(), through the request queue if there is one. Returns
+        failed if the queue is full or a newer request replaced this one.
+        """
+        if self.__queue is None:
+            return compute()
+        try:
+            return self.__queue.run(self.__session, key, compute)
+        except (QueueFull, Superseded) as e:
+            print("Dropped request", key, e)
+            return failed
+
+    def parse_snapped_path(self, x_lat, x_lon, y_lat, y_lon):
+        """
+        Waypoints for a route between points snapped to road segments:
+        the snapped start as a (lat, lon) tuple, the vertex ids driven
+        through, then the snapped end. Snapped points that land on a
+        route vertex are not repeated.
+        """
+        with self.__stats.phase('search'):
+            start, ids, end = self.search(
+                ('snapped', x_lat, x_lon, y_lat, y_lon),
+                lambda: self.__server.route_between_points(
+                                                x_lat, x_lon, y_lat, y_lon),
+                (None, [], None))
+        if start is None:
+            return []
+
+        def point(snap):
+            # Nothing to add when the snap is exactly on a route vertex
+            vertex = snap.u if snap.t < 0.5 else snap.v
+            if snap.t in (0.0, 1.0) and vertex in ids:
+                return []
+            return [(round(snap.lat), round(snap.lon))]
+
+        return point(start) + list(ids) + point(end)
 
     def closest_point(self, lat, lon):
-        min_point, min_dist = (0, 0), float('inf')
-        for v_id, v_map in self.__vertex_map.items():
-            v_lat, v_lon = float(v_map['lat']), float(v_map['lon'])
-            dist = cost(lat, lon, v_lat, v_lon)
-            if dist < min_dist:
-                min_dist = dist
+        """
+        Returns (distance, vertex) of the vertex nearest to (lat, lon).
+        Candidates are compared by squared distance, which for integer
+        coordinates is exact integer arithmetic; only the winner's
+        distance takes a square root.
+
+        A vertex_map with coordinate_arrays(), such as a CoordStore, is
+        searched with one vectorized pass over its columns, and only the
+        winner is turned into a dictionary.
+
+        >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=3, lon=4)}
+        >>> Repl(None, vmap).closest_point(6, 8)
+        (5.0, {'id': 2, 'lat': 3, 'lon': 4})
+
+        >>> import os, tempfile
+        >>> from .coord_store import CoordStore, write_coord_store
+        >>> vmap[3] = dict(id=3, lat=-40000, lon=50000)
+        >>> with tempfile.TemporaryDirectory() as d:
+        ...     write_coord_store(os.path.join(d, 'c.bin'), vmap)
+        ...     store = CoordStore(os.path.join(d, 'c.bin'))
+        ...     print(Repl(None, store).closest_point(6, 8))
+        ...     print(Repl(None, store).closest_point(-40000, 49999))
+        ...     store.close()
+        (5.0, {'id': 2, 'lat': 3, 'lon': 4})
+        (1.0, {'id': 3, 'lat': -40000, 'lon': 50000})
+        """
+        arrays = getattr(self.__vertex_map, 'coordinate_arrays', None)
+        if arrays is not None and len(self.__vertex_map):
+            ids, lats, lons = arrays()
+            # int64, as squares of int32 coordinate differences overflow
+            d_lat = lats.astype(np.int64) - lat
+            d_lon = lons.astype(np.int64) - lon
+            sq = d_lat * d_lat + d_lon * d_lon
+            i = int(np.argmin(sq))
+            return math.sqrt(sq[i]), self.__vertex_map[int(ids[i])]
+
+        min_point, min_sq = (0, 0), float('inf')
+        for v_map in self.__vertex_map.values():
+            d_lat, d_lon = lat - v_map['lat'], lon - v_map['lon']
+            sq = d_lat * d_lat + d_lon * d_lon
+            if sq < min_sq:
+                min_sq = sq
                 min_point = v_map
 
-        return min_dist, min_point
-
-def fresh_repl(stdin=None, stdout=None):
-    srv, vmap = create_server()
-    return Repl(srv, vmap, stdin=stdin, stdout=stdout)
+        return math.sqrt(min_sq), min_point
+
+def fresh_repl(stdin=None, stdout=None, stats=None, coords_path=None,
+               segments=False, pixels=False, levels=False, graph_path=None,
+               load_workers=None, fixed_point=None, turn_restrictions=None,
+               left_turn=0):
+    srv, vmap = create_server(stats=stats, coords_path=coords_path,
+                              segments=segments, graph_path=graph_path,
+                              load_workers=load_workers,
+                              fixed_point=fixed_point,
+                              turn_restrictions=turn_restrictions,
+                              left_turn=left_turn)
+    return Repl(srv, vmap, stdin=stdin, stdout=stdout, pixels=pixels,
+                levels=levels)
 
 def main():
     repl = fresh_repl()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# A queue in front of Server for many sessions sharing it, e.g. one thread
+# per client as in comm.py with several serial ports. At most `workers` queries run at once; a query still waiting
+# for its turn is dropped if its session has asked something newer since,
+# identical queries share one computation, and once max_pending requests
+# are waiting new ones are turned away instead of piling up.
+
+import doctest
+import threading
+
+# Local modules
+from .stats import NULL_STATS
+
+class QueueFull(Exception):
+    pass
+
+class Superseded(Exception):
+    pass
+
+class _Job:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = []
+
+class RequestQueue:
+    """
+    Args:
+        workers (int): Queries computed at the same time.
+        max_pending (int): Requests allowed to wait or run at once;
+            run raises QueueFull beyond that.
+        stats: Counts queue_deduplicated, queue_superseded and
+            queue_rejected requests.
+
+    >>> import time
+    >>> q = RequestQueue(workers=1)
+    >>> gate = threading.Event()
+    >>> calls = []
+    >>> def slow(key):
+    ...     def compute():
+    ...         calls.append(key)
+    ...         gate.wait()
+    ...         return key.upper()
+    ...     return compute
+    >>> results = {}
+    >>> def ask(name, session, key):
+    ...     try:
+    ...         results[name] = q.run(session, key, slow(key))
+    ...     except Superseded:
+    ...         results[name] = 'superseded'
+    >>> def start(*args):
+    ...     n = q.pending() + 1
+    ...     t = threading.Thread(target=ask, args=args)
+    ...     t.start()
+    ...     while q.pending() < n:
+    ...         time.sleep(0.001)
+    ...     return t
+    >>> threads = [start('a', 1, 'x'),   # computing, holds the only worker
+    ...            start('b', 2, 'x'),   # same query: waits for a's answer
+    ...            start('c', 3, 'y'),   # waits for the worker...
+    ...            start('d', 3, 'z')]   # ...and is superseded by this
+    >>> gate.set()
+    >>> for t in threads:
+    ...     t.join()
+    >>> sorted(results.items()), calls
+    ([('a', 'X'), ('b', 'X'), ('c', 'superseded'), ('d', 'Z')], ['x', 'z'])
+    """
+    def __init__(self, workers=1, max_pending=16, stats=None):
+        self.__lock = threading.Lock()
+        self.__workers = threading.Semaphore(workers)
+        self.__max_pending = max_pending
+        self.__stats = stats or NULL_STATS
+
+        self.__seq = 0
+        self.__latest = {}
+        self.__jobs = {}
+        self.__pending = 0
+
+    def pending(self):
+        return self.__pending
+
+    def __wanted(self, job):
+        latest = self.__latest
+        return any(latest.get(session) == seq for session, seq in job.waiters)
+
+    def run(self, session, key, compute):
+        """
+        Returns compute(), or the result of the identical query with the
+        same key already in flight.
+
+        Raises:
+            QueueFull: Too many requests are pending.
+            Superseded: The session made a newer request meanwhile, so
+                the answer would not be used.
+        """
+        stats = self.__stats
+        with self.__lock:
+            if self.__pending >= self.__max_pending:
+                stats.incr('queue_rejected')
+                raise QueueFull("%d requests pending"%(self.__pending))
+
+            self.__seq += 1
+            seq = self.__latest[session] = self.__seq
+            job = self.__jobs.get(key)
+            leader = job is None
+            if leader:
+                job = self.__jobs[key] = _Job()
+            else:
+                stats.incr('queue_deduplicated')
+            job.waiters.append((session, seq))
+            self.__pending += 1
+
+        try:
+            if leader:
+                self.__lead(key, job, compute)
+            else:
+                job.done.wait()
+        finally:
+            with self.__lock:
+                self.__pending -= 1
+                superseded = self.__latest.get(session) != seq
+                if not superseded:
+                    del self.__latest[session]
+
+        if superseded:
+            raise Superseded(key)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def __lead(self, key, job, compute):
+        with self.__workers:
+            with self.__lock:
+                if not self.__wanted(job):
+                    # Nobody waiting on this any more; a later identical
+                    # query starts a fresh job.
+                    del self.__jobs[key]
+                    self.__stats.incr('queue_superseded')
+                    job.error = Superseded(key)
+                    job.done.set()
+                    return
+
+            try:
+                job.result = compute()
+            except Exception as e:
+                job.error = e
+            finally:
+                with self.__lock:
+                    del self.__jobs[key]
+                job.done.set()
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Route replies encoded once and kept. A route asked for again is sent
+# from the cached text, with no vertex lookups or formatting per waypoint.
+
+import doctest
+import collections
+
+# Local modules
+from . import map_tiles
+from .defs import PathLength, PixelDelta, PixelPoint, WayPoint
+from .stats import NULL_STATS
+
+class EncodedRoute:
+    """
+    A whole reply, header and waypoint lines, as one string with the
+    offset just past each line's newline.
+
+    >>> route = EncodedRoute.encode([5350000, 5350100], [-11350000, -11350000])
+    >>> route.text
+    'N 2\\nW 5350000 -11350000\\nW 5350100 -11350000\\n'
+    >>> list(route.lines())
+    ['N 2', 'W 5350000 -11350000', 'W 5350100 -11350000']
+    >>> list(EncodedRoute.encode([5350000, 5350100], [-11350000, -11349900],
+    ...                          map_num=3).lines())
+    ['N 2', 'P 2172 2066', 'D 12 -19']
+    >>> EncodedRoute.encode([], [], level=2).text
+    'N 0 2\\n'
+    """
+    __slots__ = ('text', 'ends')
+
+    def __init__(self, text, ends):
+        self.text = text
+        self.ends = ends
+
+    @classmethod
+    def encode(cls, lats, lons, map_num=None, count=None, level=None):
+        """
+        Encode a reply to a route through (lats, lons): 'W lat lon'
+        lines, or pixel steps on map map_num if given. count is the
+        number announced in the 'N' header, len(lats) by default. A
+        route simplified for detail level (map number) level says so
+        as a second header field, 'N count level'.
+        """
+        if count is None:
+            count = len(lats)
+
+        if map_num is None:
+            lines = ['%s %d %d'%(WayPoint, lat, lon)
+                        for lat, lon in zip(lats, lons)]
+        else:
+            steps = map_tiles.pixel_deltas(
+                                    *map_tiles.project(map_num, lats, lons))
+            lines = ['%s %d %d'%(PixelDelta, x, y) for x, y in steps]
+            if lines:
+                lines[0] = PixelPoint + lines[0][len(PixelDelta):]
+
+        header = '%s %d'%(PathLength, count)
+        if level is not None:
+            header += ' %d'%(level)
+        lines.insert(0, header)
+        ends, end = [], 0
+        for line in lines:
+            end += len(line) + 1
+            ends.append(end)
+
+        return cls('\n'.join(lines) + '\n', ends)
+
+    def lines(self):
+        """
+        The lines of the reply, without their newlines.
+        """
+        text, start = self.text, 0
+        for end in self.ends:
+            yield text[start:end - 1]
+            start = end
+
+    def __len__(self):
+        return len(self.ends)
+
+class ResponseCache:
+    """
+    Least recently used cache of EncodedRoutes.
+
+    >>> cache = ResponseCache(maxsize=2)
+    >>> for key in 'aba':
+    ...     cache.put(key, EncodedRoute.encode([], []))
+    >>> cache.put('c', EncodedRoute.encode([], []))
+    >>> cache.get('a') is not None, cache.get('b'), len(cache)
+    (True, None, 2)
+    """
+    def __init__(self, maxsize=256, stats=None):
+        self.__maxsize = maxsize
+        self.__routes = collections.OrderedDict()
+        self.__stats = stats or NULL_STATS
+
+    def get(self, key):
+        route = self.__routes.get(key)
+        if route is not None:
+            self.__routes.move_to_end(key)
+        self.__stats.incr('response_cache_hits' if route is not None
+                            else 'response_cache_misses')
+        return route
+
+    def put(self, key, route):
+        self.__routes[key] = route
+        self.__routes.move_to_end(key)
+        if len(self.__routes) > self.__maxsize:
+            self.__routes.popitem(last=False)
+
+    def clear(self):
+        self.__routes.clear()
+
+    def __len__(self):
+        return len(self.__routes)
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Street names of edges, interned: every distinct name is stored once and
+# edges refer to it by a small integer id, with an inverted index from each
+# name to its edges so that per-street questions never scan the network.
+
+import doctest
+
+class RoadNames:
+    """
+    Maps edges to street names and names to edges. Supports item
+    assignment so that it can be passed as deserialize_graph's edge_names.
+
+    >>> roads = RoadNames()
+    >>> roads[(1, 2)] = roads[(2, 1)] = 'Whyte Ave'
+    >>> roads[(2, 3)] = 'Gateway Blvd'
+    >>> roads[(1, 2)], roads.get((3, 2))
+    ('Whyte Ave', None)
+    >>> roads.edges('Whyte Ave')
+    [(1, 2), (2, 1)]
+    >>> sorted(roads.vertices('Whyte Ave')), roads.edges('Jasper Ave')
+    ([1, 2], [])
+    >>> roads.names(), len(roads)
+    (['Whyte Ave', 'Gateway Blvd'], 3)
+    >>> roads[(2, 3)] = 'Whyte Ave'
+    >>> roads.edges('Gateway Blvd'), len(roads.edges('Whyte Ave'))
+    ([], 3)
+    """
+    def __init__(self, edge_names=None):
+        self.__ids = {}
+        self.__names = []
+        self.__edge_name = {}
+        self.__edges_by_name = []
+
+        if edge_names is not None:
+            for e, name in edge_names.items():
+                self[e] = name
+
+    def intern(self, name):
+        """
+        Returns the id of name, assigning the next one if it is new.
+        """
+        name_id = self.__ids.get(name)
+        if name_id is None:
+            name_id = self.__ids[name] = len(self.__names)
+            self.__names.append(name)
+            self.__edges_by_name.append([])
+        return name_id
+
+    def __setitem__(self, e, name):
+        name_id = self.intern(name)
+        old_id = self.__edge_name.get(e)
+        if old_id == name_id:
+            return
+        if old_id is not None:
+            self.__edges_by_name[old_id].remove(e)
+
+        self.__edge_name[e] = name_id
+        self.__edges_by_name[name_id].append(e)
+
+    def __getitem__(self, e):
+        return self.__names[self.__edge_name[e]]
+
+    def get(self, e, default=None):
+        name_id = self.__edge_name.get(e)
+        if name_id is None:
+            return default
+        return self.__names[name_id]
+
+    def __contains__(self, e):
+        return e in self.__edge_name
+
+    def __len__(self):
+        return len(self.__edge_name)
+
+    def items(self):
+        for e, name_id in self.__edge_name.items():
+            yield e, self.__names[name_id]
+
+    def names(self):
+        return list(self.__names)
+
+    def edges(self, name):
+        """
+        The edges with the given name, in O(number of such edges).
+        """
+        name_id = self.__ids.get(name)
+        if name_id is None:
+            return []
+        return list(self.__edges_by_name[name_id])
+
+    def vertices(self, name):
+        found = set()
+        for u, v in self.edges(name):
+            found.add(u)
+            found.add(v)
+        return found
+
+if __name__ == '__main__':
+    doctest.testmod()
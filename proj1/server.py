@@ -3,9 +3,26 @@
 import math
 import doctest
 
+import numpy as np
+
 # Local modules
-from .graph_v2 import Graph, deserialize_graph
+from .graph_v2 import Graph, deserialize_graph, DEFAULT_ROADS_PATH
 from .binary_heap import BinaryHeap
+from .metrics import get_metric, to_fixed_point
+from .coord_store import (
+    coordinate_arrays,
+    lookup_coordinates,
+    open_coord_store,
+)
+from .stats import NULL_STATS
+from . import hooks
+from .partition import Partition, grid_cells
+from .landmarks import Landmarks, open_landmarks, reverse_adjacency
+from .road_names import RoadNames
+from .snapping import SegmentIndex, snapped_path
+from .alternatives import alternative_routes
+from .graph_store import open_graph_store
+from .turns import TurnTable, read_turn_restrictions
 
 def retrieve_attrs(vertex_map, v_id):
     """
@@ -19,25 +36,75 @@ def retrieve_attrs(vertex_map, v_id):
     data = vertex_map.get(v_id, {})
     return data.get('lat', 0), data.get('lon', 0) 
 
+INF = float("inf")
+
 def cost(x_lat, x_lon, y_lat, y_lon):
     return math.sqrt((x_lat - y_lat)**2 + (x_lon - y_lon)**2)
 
 class Server:
-    def __init__(self, graph):
+    """
+    Args:
+        costs: Precomputed cost map, any mapping with get and item
+            assignment such as GraphStore.costs(); built from the
+            vertex coordinates with metric when omitted.
+        fixed_point (int): If given, the costs the server computes are
+            integers in 1/fixed_point units of the metric, rounded once
+            when they are computed, so that searches only add integers
+            and find the same routes on every machine.
+    """
+    def __init__(self, graph, vertex_map=None, metric=None, stats=None,
+                 edge_names=None, costs=None, fixed_point=None):
         self.__graph = graph
-        self.__vertex_map = {}
-
-        self.__cost_map = self.create_cost_map()
+        self.__vertex_map = vertex_map or {}
+        if not isinstance(edge_names, RoadNames):
+            edge_names = RoadNames(edge_names)
+        self.__roads = edge_names
+        self.__update_listeners = []
+        self.__metric = get_metric(metric)
+        self.__fixed_point = fixed_point
+        self.stats = stats or NULL_STATS
+        self.__partition = None
+        self.__landmarks = None
+        self.__segments = None
+        self.__turns = None
+        self.__reverse = None
+
+        if costs is not None:
+            self.__cost_map = costs
+        else:
+            with hooks.span(hooks.COST_MAP, graph=graph):
+                self.__cost_map = self.create_cost_map()
 
     def create_cost_map(self):
-        e_iter = self.__graph.edge_mappings()
-        edge_map = {}
-        for src, destinations in e_iter:
-            for dest in destinations:
-                e = (src, dest)
-                edge_map[e] = self.cost_distance(e)
+        """
+        Computes the cost of every edge in the graph in a single
+        vectorized pass of the metric over the endpoint coordinates.
+
+        Efficiency: O(E log(V)), all of it outside of the interpreter
+            except for building the final dictionary.
+
+        >>> g = Graph({1, 2, 3}, [(1, 2), (2, 3), (3, 1)])
+        >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=3, lon=4),
+        ...         3: dict(id=3, lat=3, lon=0)}
+        >>> cmap = Server(g, vmap).create_cost_map()
+        >>> sorted(cmap.items())
+        [((1, 2), 5.0), ((2, 3), 4.0), ((3, 1), 3.0)]
+        >>> vmap[3]['lon'] = 1
+        >>> sorted(Server(g, vmap, fixed_point=10).create_cost_map().items())
+        [((1, 2), 50), ((2, 3), 30), ((3, 1), 32)]
+        """
+        src, dst = self.__graph.edge_arrays()
+        if not len(src):
+            return {}
+
+        coords = coordinate_arrays(self.__vertex_map)
+        src_lat, src_lon = lookup_coordinates(coords, src)
+        dst_lat, dst_lon = lookup_coordinates(coords, dst)
+        weights = self.__metric(src_lat, src_lon, dst_lat, dst_lon)
+        if self.__fixed_point is not None:
+            weights = to_fixed_point(weights, self.__fixed_point)
 
-        return edge_map
+        return dict(zip(zip(src.tolist(), dst.tolist()), weights.tolist()))
 
     def cost_distance(self, e):
         """Computes and returns the straight-line distance between the two
@@ -49,19 +116,383 @@ class Server:
             ending vertex of the edge.
 
         Returns:
-            numeric value: the distance between the two vertices.
+            numeric value: the distance between the two vertices, an
+                integer in fixed point mode.
         """
         start_id, end_id = e
         start_lat, start_lon = retrieve_attrs(self.__vertex_map, start_id)
         end_lat, end_lon     = retrieve_attrs(self.__vertex_map, end_id)
 
-        return cost(start_lat, start_lon, end_lat, end_lon)
+        dist = float(self.__metric(start_lat, start_lon, end_lat, end_lon))
+        if self.__fixed_point is not None:
+            return to_fixed_point(dist, self.__fixed_point)
+        return dist
+
+    def edge_cost(self, e):
+        return self.__cost_map.get(e, float("inf"))
+
+    def update_edge_costs(self, costs):
+        """
+        Set new costs for some edges, e.g. for closures (float('inf'))
+        or traffic, without rebuilding the server. Only work proportional
+        to the change is done: partition cells containing a changed edge
+        are rebuilt, landmarks are dropped only if some cost went down
+        (higher costs leave their lower bounds valid), and update
+        listeners are told which edges changed.
+
+        Args:
+            costs: dict or iterable of (edge, new cost) pairs.
+
+        Returns:
+            list: The edges whose cost actually changed.
+
+        >>> from .graph_v2 import graph_from_arrays, random_grid_arrays
+        >>> g, vmap = graph_from_arrays(*random_grid_arrays(3, 3, seed=1, drop=0))
+        >>> srv = Server(g, vmap)
+        >>> srv.least_cost_path_internal(0, 2)
+        [0, 1, 2]
+        >>> closed = float('inf')
+        >>> srv.update_edge_costs({(0, 1): closed, (1, 0): closed})
+        [(0, 1), (1, 0)]
+        >>> srv.least_cost_path_internal(0, 2)
+        [0, 3, 4, 5, 2]
+        >>> srv.update_edge_costs({(0, 1): srv.cost_distance((0, 1))})
+        [(0, 1)]
+        >>> srv.least_cost_path_internal(0, 2)
+        [0, 1, 2]
+        >>> srv.update_edge_costs({(0, 1): float('nan')})
+        Traceback (most recent call last):
+            ...
+        ValueError: cost of (0, 1) is nan
+        """
+        if hasattr(costs, 'items'):
+            costs = costs.items()
+
+        # Checked before anything changes: nan fails every comparison, so
+        # a search would treat it as neither closed nor more expensive.
+        costs = list(costs)
+        for e, new_cost in costs:
+            if new_cost != new_cost:
+                raise ValueError("cost of %r is nan"%(e,))
+
+        changed = []
+        decreased = False
+        for e, new_cost in costs:
+            old_cost = self.__cost_map.get(e)
+            if old_cost is None or old_cost == new_cost:
+                continue
+            self.__cost_map[e] = new_cost
+            decreased = decreased or new_cost < old_cost
+            changed.append(e)
+
+        if not changed:
+            return changed
+
+        if self.__partition is not None:
+            self.__partition.update_edges(changed)
+        if decreased:
+            self.__landmarks = None
+        for listener in self.__update_listeners:
+            listener(changed)
+
+        return changed
+
+    def road_edges(self, name):
+        return self.__roads.edges(name)
+
+    def road_names(self):
+        return self.__roads
+
+    def update_road(self, name, factor):
+        """
+        Scale the cost of every edge of the named road to factor times
+        its geometric cost: 1 restores it, float('inf') closes it.
+
+        >>> g = Graph({1, 2, 3}, [(1, 2), (2, 1), (2, 3), (3, 2), (1, 3)])
+        >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=0, lon=3),
+        ...         3: dict(id=3, lat=0, lon=6)}
+        >>> names = {(1, 2): 'Whyte Ave', (2, 1): 'Whyte Ave'}
+        >>> srv = Server(g, vmap, edge_names=names)
+        >>> srv.update_road('Whyte Ave', 2)
+        [(1, 2), (2, 1)]
+        >>> srv.edge_cost((1, 2)), srv.edge_cost((2, 1))
+        (6.0, 6.0)
+        >>> srv = Server(g, vmap, edge_names=names, fixed_point=1)
+        >>> srv.update_road('Whyte Ave', 1.5)
+        [(1, 2), (2, 1)]
+        >>> srv.edge_cost((1, 2)), srv.edge_cost((1, 3))
+        (4, 6)
+        >>> vmap[2] = dict(id=2, lat=0, lon=0)    # 1 and 2 coincide
+        >>> srv = Server(g, vmap, edge_names=names)
+        >>> srv.update_road('Whyte Ave', float('inf'))
+        [(1, 2), (2, 1)]
+        >>> srv.edge_cost((1, 2)), srv.least_cost_path_internal(2, 1)
+        (inf, [])
+        """
+        # inf times a zero-length edge would be nan, not closed
+        scaled = ((e, INF if factor == INF else self.cost_distance(e) * factor)
+                    for e in self.road_edges(name))
+        if self.__fixed_point is not None:
+            scaled = ((e, to_fixed_point(c)) for e, c in scaled)
+        return self.update_edge_costs(scaled)
+
+    def add_update_listener(self, listener):
+        """
+        listener(changed_edges) is called after every update that changed
+        at least one edge cost, so caches built on costs can invalidate.
+        """
+        self.__update_listeners.append(listener)
 
     def least_cost_path_internal(self, start, dest):
-        cost = lambda e: self.__cost_map.get(e, float("inf"))
-        return self.least_cost_path(start, dest, cost)
+        # Partition shortcuts know nothing of turns, so a turn table
+        # takes precedence; landmark bounds still hold as turns only
+        # add cost.
+        if self.__partition is not None and self.__turns is None:
+            return self.least_cost_path_multilevel(start, dest)
+
+        heuristic = None
+        if self.__landmarks is not None:
+            heuristic = self.__landmarks.heuristic(dest)
+        if self.__turns is not None:
+            return self.least_cost_path_turns(start, dest, self.edge_cost,
+                                              self.__turns, heuristic)
+        return self.least_cost_path(start, dest, self.edge_cost, heuristic)
+
+    def alternative_routes(self, start, dest, k=3, max_stretch=1.4,
+                           max_overlap=0.7, penalty=1.4, max_tries=None):
+        """
+        Up to k different routes from start to dest: the least cost path
+        first, then alternatives by increasing cost; see alternatives.py.
+        Every route respects the attached turn table, if any.
+
+        Args:
+            max_stretch: An alternative costs at most this many times as
+                much as the least cost path.
+            max_overlap: Largest fraction of an alternative's cost that
+                may be spent on the roads of any route already chosen;
+                lower values give more distinct routes.
+            penalty: Factor the cost of every edge of the last route
+                found is multiplied by before searching again.
+            max_tries: Searches to make before giving up on finding k
+                routes, 4 * k by default.
+
+        >>> from .graph_v2 import graph_from_arrays, random_grid_arrays
+        >>> g, vmap = graph_from_arrays(*random_grid_arrays(6, 6, seed=1, drop=0))
+        >>> srv = Server(g, vmap)
+        >>> routes = srv.alternative_routes(0, 35, k=3)
+        >>> len(routes), routes[0] == srv.least_cost_path_internal(0, 35)
+        (3, True)
+        >>> costs = [sum(map(srv.edge_cost, zip(r, r[1:]))) for r in routes]
+        >>> costs == sorted(costs), costs[-1] <= 1.4 * costs[0]
+        (True, True)
+        >>> len(set(map(tuple, routes))), srv.alternative_routes(0, 0)
+        (3, [[0]])
+
+        Banning the turns the alternatives made keeps every route off them:
+
+        >>> from .turns import TurnTable
+        >>> banned = {t for r in routes[1:] for t in zip(r, r[1:], r[2:])}
+        >>> srv.attach_turns(TurnTable(banned=banned))
+        >>> routes = srv.alternative_routes(0, 35, k=3)
+        >>> len(routes) > 1, any(t in banned for r in routes
+        ...                      for t in zip(r, r[1:], r[2:]))
+        (True, False)
+        """
+        if self.__reverse is None:
+            # Edges never change, only their costs, so this is kept
+            self.__reverse = reverse_adjacency(self.__graph)
+        return alternative_routes(self, self.__reverse, start, dest, k=k,
+                                  max_stretch=max_stretch,
+                                  max_overlap=max_overlap, penalty=penalty,
+                                  max_tries=max_tries)
+
+    def attach_turns(self, turns):
+        """
+        Route least_cost_path_internal around the banned turns and with
+        the turn costs of the TurnTable turns from now on; None goes back
+        to ignoring turns.
+        """
+        self.__turns = turns
+
+    def turns(self):
+        return self.__turns
+
+    def build_landmarks(self, k=8, seed=None, filename=None, source_path=None):
+        """
+        Precompute ALT distance tables for k landmarks and use them to
+        direct least_cost_path_internal from now on; see landmarks.py.
+        With a filename the tables are kept there and only rebuilt when
+        they were saved for another graph; source_path is the file the
+        graph was read from (see open_landmarks).
+
+        >>> from .graph_v2 import graph_from_arrays, random_grid_arrays
+        >>> g, vmap = graph_from_arrays(*random_grid_arrays(10, 10, seed=8))
+        >>> srv = Server(g, vmap)
+        >>> plain = srv.least_cost_path_internal(0, 99)
+        >>> lm = srv.build_landmarks(k=4, seed=0)
+        >>> srv.least_cost_path_internal(0, 99) == plain
+        True
+        """
+        if filename is not None:
+            landmarks = open_landmarks(filename, self.__graph, self.edge_cost,
+                                       source_path, k=k, seed=seed)
+        else:
+            landmarks = Landmarks.build(self.__graph, self.edge_cost,
+                                        k=k, seed=seed)
+        self.attach_landmarks(landmarks)
+        return self.__landmarks
+
+    def attach_landmarks(self, landmarks):
+        self.__landmarks = landmarks
+
+    def build_partition(self, cells_per_side=8):
+        """
+        Split the graph into a cells_per_side x cells_per_side grid of
+        cells, precompute the boundary distances of each cell and route
+        least_cost_path_internal through the result from now on.
+        """
+        cell_of = grid_cells(self.__vertex_map, self.__graph.vertices(),
+                             cells_per_side)
+        self.attach_partition(Partition(self.__graph, self.edge_cost, cell_of))
+        return self.__partition
+
+    def attach_partition(self, partition):
+        self.__partition = partition
+
+    def least_cost_path_multilevel(self, start, dest):
+        """
+        Same cost as least_cost_path(start, dest, self.edge_cost), but
+        only the cells of start and dest are searched edge by edge; see
+        partition.py.
+
+        >>> from .graph_v2 import graph_from_arrays, random_grid_arrays
+        >>> g, vmap = graph_from_arrays(*random_grid_arrays(8, 8, seed=2))
+        >>> srv = Server(g, vmap)
+        >>> plain = srv.least_cost_path_internal(0, 63)
+        >>> part = srv.build_partition(cells_per_side=2)
+        >>> srv.least_cost_path_internal(0, 63) == plain
+        True
+        """
+        if self.__partition is None:
+            raise ValueError("no partition attached, see build_partition")
+
+        if start == dest and self.__graph.is_vertex(start):
+            return [start]
+
+        with hooks.span(hooks.SEARCH, start=start, dest=dest):
+            return self.__partition.least_cost_path(start, dest)
+
+    def build_segment_index(self, cell_size=None):
+        """
+        Index the road segments so that route_between_points can snap to
+        the nearest segment instead of the nearest vertex.
+        """
+        self.__segments = SegmentIndex(self.__graph, self.__vertex_map,
+                                       cell_size)
+        return self.__segments
+
+    def segment_index(self):
+        return self.__segments
+
+    def route_between_points(self, x_lat, x_lon, y_lat, y_lon):
+        """
+        Snap both points to their nearest road segments and route between
+        the snapped points, paying only for the part of the first and
+        last segments actually driven.
+
+        Returns (start Snap, list of vertex ids, end Snap); the list is
+        empty, and both snaps None, when there is no route. Snapped routes
+        cannot respect turns, so a ValueError is raised while a turn table
+        is attached.
+
+        >>> g = Graph({1, 2, 3, 4}, [(1, 2), (2, 1), (2, 3), (3, 2),
+        ...                          (3, 4), (4, 3)])
+        >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=0, lon=100),
+        ...         3: dict(id=3, lat=100, lon=100),
+        ...         4: dict(id=4, lat=100, lon=0)}
+        >>> srv = Server(g, vmap)
+        >>> _ = srv.build_segment_index()
+        >>> start, ids, end = srv.route_between_points(5, 90, 90, 95)
+        >>> ids, (start.lat, start.lon), (end.lat, end.lon)
+        ([2], (0.0, 90.0), (90.0, 100.0))
+        >>> from .turns import TurnTable
+        >>> srv.attach_turns(TurnTable(banned=[(1, 2, 3)]))
+        >>> srv.route_between_points(5, 90, 90, 95)
+        Traceback (most recent call last):
+        ...
+        ValueError: snapped routes do not apply turns, see attach_turns
+        """
+        if self.__segments is None:
+            raise ValueError("no segment index, see build_segment_index")
+        if self.__turns is not None:
+            raise ValueError("snapped routes do not apply turns, see attach_turns")
+
+        source = self.__segments.nearest(x_lat, x_lon)
+        target = self.__segments.nearest(y_lat, y_lon)
+        if source is None or target is None:
+            return None, [], None
 
-    def least_cost_path(self, start, dest, cost):
+        with hooks.span(hooks.SEARCH, start=source, dest=target):
+            total, ids = snapped_path(self.__graph, self.edge_cost,
+                                      source, target)
+        if total == INF:
+            return None, [], None
+
+        return source, ids, target
+
+    def least_cost_path_avoiding(self, start, dest, names):
+        """
+        Least cost path that uses no edge of the named roads. Only the
+        avoided roads' edges are looked up, through the road name index.
+
+        >>> g = Graph({1, 2, 3}, [(1, 2), (2, 1), (2, 3), (3, 2), (1, 3), (3, 1)])
+        >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=0, lon=3),
+        ...         3: dict(id=3, lat=4, lon=3)}
+        >>> names = {(1, 3): 'Whyte Ave', (3, 1): 'Whyte Ave'}
+        >>> srv = Server(g, vmap, edge_names=names)
+        >>> srv.least_cost_path_internal(1, 3)
+        [1, 3]
+        >>> srv.least_cost_path_avoiding(1, 3, ['Whyte Ave'])
+        [1, 2, 3]
+        """
+        avoided = set()
+        for name in names:
+            avoided.update(self.__roads.edges(name))
+
+        cost = lambda e: INF if e in avoided else self.edge_cost(e)
+
+        # Avoiding roads only raises costs, so landmark bounds still hold;
+        # partition shortcuts might run along the avoided roads though.
+        heuristic = None
+        if self.__landmarks is not None:
+            heuristic = self.__landmarks.heuristic(dest)
+        return self.least_cost_path(start, dest, cost, heuristic)
+
+    def closest_point_on_road(self, name, lat, lon):
+        """
+        Returns (distance, vertex id) of the vertex of the named road
+        nearest to (lat, lon), or (inf, None) for an unknown road.
+
+        >>> g = Graph({1, 2, 3}, [(1, 2), (2, 1), (2, 3), (3, 2)])
+        >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=0, lon=3),
+        ...         3: dict(id=3, lat=4, lon=3)}
+        >>> names = {(2, 3): 'Whyte Ave', (3, 2): 'Whyte Ave'}
+        >>> srv = Server(g, vmap, edge_names=names)
+        >>> srv.closest_point_on_road('Whyte Ave', 0, 0)
+        (3.0, 2)
+        >>> srv.closest_point_on_road('Jasper Ave', 0, 0)
+        (inf, None)
+        """
+        best = (INF, None)
+        for v_id in self.__roads.vertices(name):
+            v_lat, v_lon = retrieve_attrs(self.__vertex_map, v_id)
+            dist = float(self.__metric(lat, lon, v_lat, v_lon))
+            if dist < best[0]:
+                best = (dist, v_id)
+
+        return best
+
+    def least_cost_path(self, start, dest, cost, heuristic=None):
         """Find and return the least cost path in graph from start
         vertext to dest vertex
 
@@ -78,6 +509,9 @@ class Server:
             cost: A function, taking a single edge as a parameter and
                 returning the cost of the edge. For its interface,
                 see the definition of cost_distance.
+            heuristic: An optional function returning a lower bound on
+                the cost from a vertex to dest, turning the search into A*.
+                See Landmarks.heuristic.
 
         Returns:
             list: A potentially empty list (if no path can be found) of
@@ -103,21 +537,142 @@ class Server:
         if start == dest:
             return [start]
 
+        with hooks.span(hooks.SEARCH, start=start, dest=dest):
+            return self.__search(start, dest, cost, heuristic)
+
+    def least_cost_path_turns(self, start, dest, cost, turns, heuristic=None):
+        """
+        Like least_cost_path, but going from edge (u, v) on to (v, w) also
+        costs turns.cost(u, v, w), which is INF for a banned turn.
+
+        The search is over edges: a route may pass a vertex more than
+        once, e.g. going around a block instead of turning left. The edge
+        graph is not built; the edges out of each reached edge are
+        expanded as it is settled, so only reached edges are stored. An
+        edge is only told apart from the other edges into its end vertex
+        where turns.restricts that vertex; with just a few banned turns
+        the search settles little more than a plain vertex search would.
+
+        >>> from .turns import TurnTable
+        >>> # A grid block:  4 - 5 - 6
+        >>> #                |   |   |
+        >>> #                1 - 2 - 3
+        >>> edges = [(1, 2), (2, 3), (1, 4), (2, 5), (3, 6), (4, 5), (5, 6)]
+        >>> graph = Graph(range(1, 7), edges + [(v, u) for u, v in edges])
+        >>> vmap = {v: dict(id=v, lat=(v - 1) // 3, lon=(v - 1) % 3)
+        ...         for v in range(1, 7)}
+        >>> srv = Server(graph, vmap)
+        >>> no_left = TurnTable(vmap, banned=[(1, 2, 5)])
+        >>> srv.least_cost_path_turns(1, 5, srv.edge_cost, no_left)
+        [1, 4, 5]
+        >>> no_left.ban(1, 4, 5)
+        >>> srv.least_cost_path_turns(1, 5, srv.edge_cost, no_left)
+        [1, 2, 3, 6, 5]
+        >>> len(srv.least_cost_path_turns(1, 5, srv.edge_cost, TurnTable()))
+        3
+        """
+        if not (self.__graph.is_vertex(start) and self.__graph.is_vertex(dest)):
+            return []
+
+        if start == dest:
+            return [start]
+
+        with hooks.span(hooks.SEARCH, start=start, dest=dest):
+            return self.__search_turns(start, dest, cost, turns, heuristic)
+
+    def __search_turns(self, start, dest, cost, turns, heuristic=None):
+        # As __search, over edges (prev, curr) instead of vertices. Where
+        # turns cannot depend on prev the state is (None, curr), shared by
+        # every edge into curr, and the search starts from (None, start)
+        # so that the first step makes no turn.
+        first = (None, start)
         R = {}
-        dist = {}
+        dist = {first: 0}
         PQ = BinaryHeap()
-        PQ.add((start, start), 0)
+        PQ.add((first, first, 0), 0)
+        pops = 0
+        found = None
         while len(PQ):
-            head, val = PQ.pop_min()
-            prev, curr = head
-            if curr not in R:
-                R[curr] = prev
-                dist[curr] = val
-                neighbours = self.__graph.neighbours(curr)
-
-                for nb in neighbours:
-                    edge = (curr, nb)
-                    PQ.add(edge, val + cost(edge))
+            head, _ = PQ.pop_min()
+            pops += 1
+            back, edge, val = head
+            if val > dist[edge]:
+                continue
+
+            R[edge] = back
+            prev, curr = edge
+            if curr == dest:
+                found = edge
+                break
+
+            for nb in self.__graph.neighbours(curr):
+                nb_val = val + cost((curr, nb))
+                if prev is not None:
+                    nb_val += turns.cost(prev, curr, nb)
+                if nb_val == INF:
+                    # Closed road or banned turn
+                    continue
+                nb_edge = (curr, nb) if turns.restricts(nb) else (None, nb)
+                if nb_edge not in dist or nb_val < dist[nb_edge]:
+                    dist[nb_edge] = nb_val
+                    key = nb_val
+                    if heuristic is not None:
+                        key += heuristic(nb)
+                    PQ.add((edge, nb_edge, nb_val), key)
+
+        if self.stats.enabled:
+            self.stats.incr('searches')
+            self.stats.incr('heap_pushes', pops + len(PQ))
+            self.stats.incr('heap_pops', pops)
+            self.stats.incr('settled', len(R))
+
+        path = []
+        while found is not None:
+            path.append(found[1])
+            found = R[found] if found != first else None
+        path.reverse()
+        return path
+
+    def __search(self, start, dest, cost, heuristic=None):
+        # R maps each expanded vertex to its predecessor, dist holds the
+        # best cost found so far to every reached vertex. A vertex is only
+        # pushed again if it got cheaper, and entries that were beaten
+        # while waiting in the heap are skipped when popped.
+        R = {}
+        dist = {start: 0}
+        PQ = BinaryHeap()
+        PQ.add((start, start, 0), 0)
+        pops = 0
+        while len(PQ):
+            head, _ = PQ.pop_min()
+            pops += 1
+            prev, curr, val = head
+            if val > dist[curr]:
+                continue
+
+            R[curr] = prev
+            if curr == dest:
+                break
+
+            for nb in self.__graph.neighbours(curr):
+                nb_val = val + cost((curr, nb))
+                if nb_val == INF:
+                    # Closed road, or no cost known for this edge
+                    continue
+                if nb not in dist or nb_val < dist[nb]:
+                    dist[nb] = nb_val
+                    key = nb_val
+                    if heuristic is not None:
+                        key += heuristic(nb)
+                    PQ.add((curr, nb, nb_val), key)
+
+        if self.stats.enabled:
+            # Every push is eventually popped, so nothing is counted
+            # inside the loop itself.
+            self.stats.incr('searches')
+            self.stats.incr('heap_pushes', pops + len(PQ))
+            self.stats.incr('heap_pops', pops)
+            self.stats.incr('settled', len(R))
 
         return back_track(R, dest)
 
@@ -161,9 +716,56 @@ def main():
     cost = lambda e: weights.get(e, float("inf"))
     print(server.least_cost_path(1, 5, cost))
 
-def create_server():
-    g, vmap= deserialize_graph()
-    srv = Server(g)
+def create_server(stats=None, coords_path=None, segments=False,
+                  graph_path=None, load_workers=None, fixed_point=None,
+                  turn_restrictions=None, left_turn=0):
+    """
+    Load the default roads file. If coords_path is given, vertex
+    coordinates are served from that memory-mapped file (built on first
+    use) instead of from per-vertex dictionaries. With segments, requests
+    are snapped to the nearest road segment rather than the nearest vertex.
+
+    If graph_path is given, the graph, coordinates and edge costs are all
+    mapped read-only from that file instead, built from the roads file on
+    first use; street names are not in it, so roads cannot be looked up
+    by name.
+
+    load_workers is passed on to deserialize_graph as workers, to parse
+    the roads file in that many processes. fixed_point is passed on to
+    Server; a graph file built with another scale is rebuilt.
+
+    With turn_restrictions, the path of a file of 'T,from,via,to' lines,
+    or a left_turn cost, routes are searched with a TurnTable. Snapped
+    routes do not apply turns, so these cannot be combined with segments.
+    """
+    with_turns = turn_restrictions is not None or left_turn
+    if segments and with_turns:
+        raise ValueError("segments cannot be combined with turn restrictions"
+                         " or turn costs")
+
+    if graph_path is not None:
+        store = open_graph_store(graph_path,
+                                 lambda: deserialize_graph(workers=load_workers),
+                                 source_path=DEFAULT_ROADS_PATH,
+                                 fixed_point=fixed_point)
+        vmap = store.vertex_map()
+        srv = Server(store, vmap, stats=stats, costs=store.costs(),
+                     fixed_point=fixed_point)
+    else:
+        names = RoadNames()
+        g, vmap= deserialize_graph(edge_names=names, workers=load_workers)
+        if coords_path is not None:
+            vmap = open_coord_store(coords_path, vmap, DEFAULT_ROADS_PATH)
+        srv = Server(g, vmap, stats=stats, edge_names=names,
+                     fixed_point=fixed_point)
+
+    if segments:
+        srv.build_segment_index()
+    if with_turns:
+        banned = ()
+        if turn_restrictions is not None:
+            banned = read_turn_restrictions(turn_restrictions)
+        srv.attach_turns(TurnTable(vmap, banned, left_turn=left_turn))
     return srv, vmap
 
 if __name__ == '__main__':
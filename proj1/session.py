@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Event-driven serving of a Repl over a file descriptor such as a serial
+# port. Reads wait in a selector with a deadline instead of blocking, so a
+# client that stops talking mid-request costs one timeout, not the process.
+
+import os
+import doctest
+import selectors
+
+# Local modules
+from . import hooks
+from .repl import (
+    DetailLevel,
+    EndOfSession,
+    Request,
+    preprocess_line,
+)
+
+# Longest line accepted; anything longer without a newline is garbage.
+MAX_LINE = 256
+
+class LineReader:
+    """
+    Line-at-a-time reads from a file descriptor, waiting at most timeout
+    seconds for each line. readline returns '' when a line does not
+    arrive in time, as a stream at its end would, and sets eof once the
+    other side has closed.
+
+    >>> r, w = os.pipe()
+    >>> reader = LineReader(r, timeout=0.01)
+    >>> _ = os.write(w, b'R 1 2 3 4\\r\\nA\\npart')
+    >>> reader.readline(), reader.pending_lines()
+    ('R 1 2 3 4\\n', ['A\\n'])
+    >>> reader.readline(), reader.readline()
+    ('A\\n', '')
+    >>> _ = os.write(w, b'ial\\n'); os.close(w)
+    >>> reader.readline(), reader.readline(), reader.eof
+    ('partial\\n', '', True)
+    >>> reader.close()
+    """
+    def __init__(self, fd, timeout=None, encoding='ISO-8859-1'):
+        self.__fd = fd
+        self.timeout = timeout
+        self.encoding = encoding
+        self.eof = False
+
+        self.__buffer = bytearray()
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(fd, selectors.EVENT_READ)
+
+    def close(self):
+        self.__selector.close()
+
+    def __next_line(self):
+        end = self.__buffer.find(b'\n')
+        if end < 0:
+            if len(self.__buffer) < MAX_LINE:
+                return None
+            # No newline in sight: hand back the garbage as one line
+            end = MAX_LINE - 1
+
+        raw = bytes(self.__buffer[:end + 1])
+        del self.__buffer[:end + 1]
+        return raw.rstrip(b'\r\n').decode(self.encoding) + '\n'
+
+    def pending_lines(self):
+        """
+        The complete lines already buffered, without consuming them.
+        """
+        lines = bytes(self.__buffer).split(b'\n')[:-1]
+        return [raw.rstrip(b'\r').decode(self.encoding) + '\n'
+                    for raw in lines]
+
+    def readline(self):
+        with hooks.span(hooks.SERIAL_READ, fd=self.__fd):
+            return self.__readline()
+
+    def __readline(self):
+        line = self.__next_line()
+        while line is None and not self.eof:
+            if not self.__selector.select(self.timeout):
+                return ''
+
+            chunk = os.read(self.__fd, 4096)
+            if not chunk:
+                self.eof = True
+                break
+
+            self.__buffer += chunk
+            line = self.__next_line()
+
+        if line is None and self.eof and self.__buffer:
+            # The last line, cut off without a newline
+            line = self.__buffer.decode(self.encoding) + '\n'
+            self.__buffer.clear()
+
+        return line or ''
+
+def serve(rpl, until=None):
+    """
+    Serve requests until until() is true, or until the client has
+    closed the connection and everything it sent has been read.
+
+    Requests are only answered after the client's 'starting' line. An
+    unknown command or a malformed request is a garbled frame: it is
+    dropped and everything after it too, until the client starts again.
+    Empty reads, i.e. timeouts, are skipped, and so is a request when
+    a newer one from the client is already waiting behind it: its
+    answer would only be read past.
+
+    >>> import io
+    >>> class EchoRepl:
+    ...     def readline(self):
+    ...         return stream.readline()
+    ...     def evaluate(self, line):
+    ...         if line.split()[0] == 'R' and len(line.split()) < 5:
+    ...             raise ValueError('too few fields')
+    ...         print('served', line.strip())
+    ...     def bos(self, head):
+    ...         return head.lower().find('starting') == 0
+    ...     def pending_lines(self):
+    ...         return stream.getvalue()[stream.tell():].splitlines()[:1]
+    ...     def at_eof(self):
+    ...         return False
+    >>> stream = io.StringIO('R 1 2 3 4\\nStarting...\\nR 1 2 3 4\\nE\\n'
+    ...                      '\\nQ\\nR 5 6 7 8\\nstarting\\nR 1 2\\nE\\n'
+    ...                      'starting\\nR 5 6 7 8\\nR 9 9 9 9\\nR 1 1 1 1\\n')
+    >>> done = lambda: stream.tell() == len(stream.getvalue())
+    >>> serve(EchoRepl(), until=done)
+    served R 1 2 3 4
+    served E
+    garbled frame: Q
+    garbled frame: R 1 2 (too few fields)
+    superseded: R 5 6 7 8
+    superseded: R 9 9 9 9
+    served R 1 1 1 1
+
+    A closed connection ends serving rather than reading '' forever:
+
+    >>> from .repl import Repl
+    >>> r, w = os.pipe()
+    >>> _ = os.write(w, b'starting\\n'); os.close(w)
+    >>> reader = LineReader(r, timeout=5)
+    >>> serve(Repl(None, {}, reader, io.StringIO()))
+    >>> reader.eof
+    True
+    >>> reader.close(); os.close(r)
+    """
+    synced = False
+    while until is None or not until():
+        line = rpl.readline()
+        if not line and rpl.at_eof():
+            return
+        fields = preprocess_line(line)
+        if not fields:
+            continue
+
+        head = fields[0]
+        if rpl.bos(head):
+            synced = True
+            continue
+        if not synced:
+            continue
+
+        if head not in (Request, DetailLevel, EndOfSession):
+            print('garbled frame:', line.strip())
+            synced = False
+            continue
+
+        if head == Request and any(preprocess_line(pending)[:1] == [Request]
+                                        for pending in rpl.pending_lines()):
+            print('superseded:', line.strip())
+            continue
+
+        try:
+            rpl.evaluate(line)
+        except ValueError as e:
+            print('garbled frame: %s (%s)'%(line.strip(), e))
+            synced = False
+
+if __name__ == '__main__':
+    doctest.testmod()
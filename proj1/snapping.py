@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Snapping to the nearest road segment rather than the nearest vertex.
+#
+# Segments are bucketed into a uniform grid over the scaled lat/lon plane;
+# a lookup scans rings of cells around the query point and stops as soon as
+# no unscanned cell can hold anything closer than the best hit so far.
+
+import math
+import doctest
+import collections
+
+import numpy as np
+
+# Local modules
+from .coord_store import coordinate_arrays, lookup_coordinates
+from .partition import dijkstra
+
+# A point on segment (u, v): fraction t of the way from u to v, at
+# (lat, lon), dist away from the point that was snapped.
+Snap = collections.namedtuple('Snap', 'u v t lat lon dist')
+
+def project(lat, lon, a_lat, a_lon, b_lat, b_lon):
+    """
+    Vectorized projection of (lat, lon) onto the segments a-b.
+    Returns (t, dist, p_lat, p_lon), with t clamped to [0, 1].
+
+    >>> t, d, p_lat, p_lon = project(1, 2, np.array([0]), np.array([0]),
+    ...                              np.array([0]), np.array([4]))
+    >>> t.tolist(), d.tolist(), p_lat.tolist(), p_lon.tolist()
+    ([0.5], [1.0], [0.0], [2.0])
+    """
+    d_lat = np.asarray(b_lat, np.float64) - a_lat
+    d_lon = np.asarray(b_lon, np.float64) - a_lon
+    length2 = d_lat * d_lat + d_lon * d_lon
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = ((lat - a_lat) * d_lat + (lon - a_lon) * d_lon) / length2
+    t = np.clip(np.nan_to_num(t), 0.0, 1.0)
+
+    p_lat = a_lat + t * d_lat
+    p_lon = a_lon + t * d_lon
+    return t, np.hypot(p_lat - lat, p_lon - lon), p_lat, p_lon
+
+class SegmentIndex:
+    """
+    Grid index over the segments of a road graph. Each pair of vertices
+    joined by an edge in either direction is one segment.
+
+    >>> from .graph_v2 import Graph
+    >>> g = Graph({1, 2, 3}, [(1, 2), (2, 1), (2, 3)])
+    >>> vmap = {1: dict(id=1, lat=0, lon=0), 2: dict(id=2, lat=0, lon=100),
+    ...         3: dict(id=3, lat=100, lon=100)}
+    >>> index = SegmentIndex(g, vmap)
+    >>> len(index)
+    2
+    >>> index.nearest(10, 40)
+    Snap(u=1, v=2, t=0.4, lat=0.0, lon=40.0, dist=10.0)
+    >>> index.nearest(60, 130)
+    Snap(u=2, v=3, t=0.6, lat=60.0, lon=100.0, dist=30.0)
+    """
+    def __init__(self, graph, vertex_map, cell_size=None):
+        src, dst = graph.edge_arrays()
+        if len(src):
+            pairs = np.unique(np.sort(np.stack((src, dst), axis=1), axis=1),
+                              axis=0)
+            pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        else:
+            pairs = np.zeros((0, 2), dtype=np.int64)
+
+        coords = coordinate_arrays(vertex_map)
+        self.__u, self.__v = pairs[:, 0], pairs[:, 1]
+        self.__u_lat, self.__u_lon = lookup_coordinates(coords, self.__u)
+        self.__v_lat, self.__v_lon = lookup_coordinates(coords, self.__v)
+
+        lo_lat = np.minimum(self.__u_lat, self.__v_lat)
+        hi_lat = np.maximum(self.__u_lat, self.__v_lat)
+        lo_lon = np.minimum(self.__u_lon, self.__v_lon)
+        hi_lon = np.maximum(self.__u_lon, self.__v_lon)
+
+        if cell_size is None:
+            # About one segment per cell along its longer side
+            extent = np.maximum(hi_lat - lo_lat, hi_lon - lo_lon)
+            cell_size = float(np.median(extent)) if len(extent) else 1.0
+        self.__cell = max(1.0, cell_size)
+
+        self.__buckets = {}
+        r0, r1 = self.__row(lo_lat), self.__row(hi_lat)
+        c0, c1 = self.__row(lo_lon), self.__row(hi_lon)
+        for i, (a, b, c, d) in enumerate(zip(r0.tolist(), r1.tolist(),
+                                             c0.tolist(), c1.tolist())):
+            for row in range(a, b + 1):
+                for col in range(c, d + 1):
+                    self.__buckets.setdefault((row, col), []).append(i)
+
+        if self.__buckets:
+            rows, cols = zip(*self.__buckets)
+            self.__bounds = (min(rows), max(rows), min(cols), max(cols))
+
+    def __row(self, v):
+        return np.floor(np.asarray(v) / self.__cell).astype(np.int64)
+
+    def __len__(self):
+        return len(self.__u)
+
+    def __ring(self, row, col, r):
+        if r == 0:
+            yield row, col
+            return
+        for c in range(col - r, col + r + 1):
+            yield row - r, c
+            yield row + r, c
+        for rw in range(row - r + 1, row + r):
+            yield rw, col - r
+            yield rw, col + r
+
+    def nearest(self, lat, lon):
+        """
+        Returns the Snap of the segment nearest to (lat, lon), or None if
+        the index is empty.
+        """
+        if not self.__buckets:
+            return None
+
+        row, col = int(self.__row(lat)), int(self.__row(lon))
+        min_row, max_row, min_col, max_col = self.__bounds
+        max_r = max(abs(row - min_row), abs(row - max_row),
+                    abs(col - min_col), abs(col - max_col))
+
+        seen = set()
+        best, best_dist = None, math.inf
+        for r in range(max_r + 1):
+            candidates = []
+            for cell in self.__ring(row, col, r):
+                for i in self.__buckets.get(cell, ()):
+                    if i not in seen:
+                        seen.add(i)
+                        candidates.append(i)
+
+            if candidates:
+                idx = np.array(candidates)
+                t, dist, p_lat, p_lon = project(lat, lon,
+                                    self.__u_lat[idx], self.__u_lon[idx],
+                                    self.__v_lat[idx], self.__v_lon[idx])
+                k = int(np.argmin(dist))
+                if dist[k] < best_dist:
+                    best_dist = float(dist[k])
+                    best = Snap(int(self.__u[idx[k]]), int(self.__v[idx[k]]),
+                                float(t[k]), float(p_lat[k]), float(p_lon[k]),
+                                best_dist)
+
+            # Everything beyond ring r is at least r cells away
+            if best is not None and best_dist <= r * self.__cell:
+                break
+
+        return best
+
+def snapped_path(graph, cost, source, target):
+    """
+    Least cost path between two Snaps, starting from a virtual node on
+    the source segment and ending at one on the target segment; only the
+    part of each end segment actually driven is paid for.
+
+    Returns (total cost, list of road vertices), or (inf, []).
+
+    >>> from .graph_v2 import Graph
+    >>> g = Graph({1, 2, 3}, [(1, 2), (2, 1), (2, 3), (3, 2)])
+    >>> cost = lambda e: 10
+    >>> a, b = Snap(1, 2, 0.25, 0, 0, 0), Snap(2, 3, 0.5, 0, 0, 0)
+    >>> snapped_path(g, cost, a, b)
+    (12.5, [2])
+    >>> snapped_path(g, cost, a, Snap(1, 2, 0.75, 0, 0, 0))
+    (5.0, [])
+    >>> snapped_path(g, cost, Snap(1, 2, 0.75, 0, 0, 0), a)
+    (5.0, [])
+    >>> closed = lambda e: math.inf if e == (1, 2) else 10
+    >>> snapped_path(g, closed, Snap(1, 2, 1.0, 0, 0, 0), b)
+    (inf, [])
+    """
+    SOURCE, TARGET = ('snap', 'source'), ('snap', 'target')
+
+    def along(u, v, fraction):
+        # Cost of driving fraction of the way along u->v, if it is a road
+        # and open: a closed one times fraction 0 would be nan.
+        if graph.is_edge((u, v)):
+            full = cost((u, v))
+            return full * fraction if full != math.inf else math.inf
+        return math.inf
+
+    s_u, s_v, s_t = source.u, source.v, source.t
+    t_u, t_v, t_t = target.u, target.v, target.t
+
+    starts = [(s_u, along(s_v, s_u, s_t)), (s_v, along(s_u, s_v, 1 - s_t))]
+    ends = {t_u: along(t_u, t_v, t_t), t_v: along(t_v, t_u, 1 - t_t)}
+
+    direct = math.inf
+    if (s_u, s_v) == (t_u, t_v):
+        if t_t >= s_t:
+            direct = along(s_u, s_v, t_t - s_t)
+        else:
+            direct = along(s_v, s_u, s_t - t_t)
+
+    def neighbours(v):
+        if v == SOURCE:
+            found = [(u, w) for u, w in starts if w != math.inf]
+            if direct != math.inf:
+                found.append((TARGET, direct))
+            return found
+        found = [(u, cost((v, u))) for u in graph.neighbours(v)]
+        if v in ends and ends[v] != math.inf:
+            found.append((TARGET, ends[v]))
+        return found
+
+    dist, parent = dijkstra(neighbours, SOURCE, {TARGET})
+    if TARGET not in dist:
+        return math.inf, []
+
+    path = []
+    v = parent[TARGET]
+    while v != SOURCE:
+        path.append(v)
+        v = parent[v]
+
+    path.reverse()
+    return dist[TARGET], path
+
+if __name__ == '__main__':
+    doctest.testmod()
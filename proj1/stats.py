@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Optional request instrumentation. Components take a `stats` object and
+# report into it; by default they get NULL_STATS, whose methods do nothing,
+# so that instrumentation costs a no-op call per request when it is off.
+
+import sys
+import time
+import doctest
+import threading
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NULL_PHASE = _NullPhase()
+
+class NullStats:
+    """
+    Stand-in used when instrumentation is off.
+
+    >>> with NULL_STATS.phase('search'):
+    ...     NULL_STATS.incr('settled', 10)
+    >>> NULL_STATS.snapshot()
+    {}
+    """
+    enabled = False
+
+    def incr(self, name, n=1):
+        pass
+
+    def record(self, name, elapsed):
+        pass
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def snapshot(self):
+        return {}
+
+    def tick(self):
+        pass
+
+NULL_STATS = NullStats()
+
+class _Phase:
+    __slots__ = ('_stats', '_name', '_began')
+
+    def __init__(self, stats, name):
+        self._stats = stats
+        self._name = name
+
+    def __enter__(self):
+        self._began = self._stats.clock()
+        return self
+
+    def __exit__(self, *args):
+        self._stats.record(self._name, self._stats.clock() - self._began)
+        return False
+
+class Stats:
+    """
+    Counters plus per-phase timings (count, total and max seconds).
+
+    Args:
+        log_every: If given, tick() writes log_line() to out at most
+            once every log_every seconds.
+        out: Stream for the periodic log line, stderr by default.
+        clock: Time source, time.perf_counter by default.
+
+    >>> ticks = iter([0.0, 0.5, 1.0, 3.0])
+    >>> s = Stats(clock=lambda: next(ticks))
+    >>> with s.phase('search'):
+    ...     s.incr('settled', 4)
+    >>> with s.phase('search'):
+    ...     s.incr('settled')
+    >>> snap = s.snapshot()
+    >>> snap['counters']
+    {'settled': 5}
+    >>> snap['phases']['search'] == dict(count=2, total=2.5, max=2.0)
+    True
+    >>> s.log_line()
+    'settled=5 search=2/2500.000ms/max2000.000ms'
+    """
+    enabled = True
+
+    def __init__(self, log_every=None, out=None, clock=time.perf_counter):
+        self.clock = clock
+        self.__log_every = log_every
+        self.__out = out
+        self.__last_log = None
+        # Sessions on other threads may share one Stats
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.__counters = {}
+        self.__phases = {}
+
+    def incr(self, name, n=1):
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + n
+
+    def record(self, name, elapsed):
+        with self.__lock:
+            entry = self.__phases.get(name)
+            if entry is None:
+                self.__phases[name] = [1, elapsed, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] = max(entry[2], elapsed)
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def snapshot(self):
+        with self.__lock:
+            return {
+                'counters': dict(self.__counters),
+                'phases': {
+                    name: dict(count=c, total=total, max=worst)
+                        for name, (c, total, worst) in self.__phases.items()
+                },
+            }
+
+    def log_line(self):
+        with self.__lock:
+            counters = sorted(self.__counters.items())
+            phases = sorted((k, tuple(v)) for k, v in self.__phases.items())
+        fields = ['%s=%d'%(k, v) for k, v in counters]
+        fields.extend('%s=%d/%.3fms/max%.3fms'%(k, c, total*1000, worst*1000)
+                        for k, (c, total, worst) in phases)
+        return ' '.join(fields)
+
+    def tick(self):
+        """
+        Emit the log line if log_every seconds have passed since the
+        last one; the first tick only starts the clock.
+
+        >>> import io
+        >>> out, ticks = io.StringIO(), iter([0, 1, 5, 6, 11])
+        >>> s = Stats(log_every=5, out=out, clock=lambda: next(ticks))
+        >>> s.incr('requests')
+        >>> for _ in range(4):
+        ...     s.tick()
+        >>> out.getvalue()
+        'stats requests=1\\n'
+        """
+        if self.__log_every is None:
+            return
+
+        now = self.clock()
+        if self.__last_log is None:
+            self.__last_log = now
+        elif now - self.__last_log >= self.__log_every:
+            self.__last_log = now
+            print('stats', self.log_line(), file=self.__out or sys.stderr)
+
+if __name__ == '__main__':
+    doctest.testmod()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Author: Emmanuel Odeke <odeke@ualberta.ca>
+# Turn restrictions and turn costs.
+#
+# Arriving at v along (u, v) and leaving along (v, w) is the turn
+# (u, v, w). Which turns are allowed depends on the edge a route arrives
+# by, not just on the vertex, so routes that respect them are searched
+# over edges instead of vertices (see Server.least_cost_path_turns). The
+# edge graph is never built: that search expands the edges out of each
+# edge it reaches, asking the TurnTable what each turn costs.
+
+import doctest
+
+# Local modules
+from .graph_v2 import to_id
+
+INF = float('inf')
+
+Restriction = 't'
+
+def is_left_turn(u, v, w):
+    """
+    True if going from (lat, lon) u through v to w turns left by more
+    than 45 degrees; latitude grows northwards, longitude eastwards.
+
+    >>> is_left_turn((0, 0), (0, 1), (1, 1))    # east, then north
+    True
+    >>> is_left_turn((0, 0), (0, 1), (-1, 1))   # east, then south
+    False
+    >>> is_left_turn((0, 0), (0, 2), (1, 4))    # east, bearing left a little
+    False
+    """
+    a_lat, a_lon = v[0] - u[0], v[1] - u[1]
+    b_lat, b_lon = w[0] - v[0], w[1] - v[1]
+    cross = a_lon * b_lat - a_lat * b_lon
+    dot = a_lon * b_lon + a_lat * b_lat
+    return cross > 0 and cross > dot
+
+class TurnTable:
+    """
+    The cost of every turn: INF for banned ones, left_turn for turning
+    left and u_turn for going straight back, 0 for anything else.
+
+    Banned turns are kept by the vertex they pass through, so a vertex
+    without restrictions costs one dictionary lookup.
+
+    Args:
+        vertex_map: Coordinates of the vertices; only needed for left_turn.
+        banned: Iterable of (u, v, w) turns that may not be made.
+        left_turn: Extra cost of a left turn, in edge cost units.
+        u_turn: Extra cost of a U-turn; INF bans them.
+
+    >>> vmap = {1: dict(lat=0, lon=0), 2: dict(lat=0, lon=1),
+    ...         3: dict(lat=1, lon=1), 4: dict(lat=-1, lon=1)}
+    >>> turns = TurnTable(vmap, banned=[(1, 2, 4)], left_turn=5, u_turn=INF)
+    >>> turns.cost(1, 2, 3), turns.cost(1, 2, 4), turns.cost(1, 2, 1)
+    (5, inf, inf)
+    >>> turns.cost(3, 2, 1), turns.cost(4, 2, 1), len(turns)
+    (0, 5, 1)
+    >>> TurnTable(banned=[(1, 2, 4)]).restricts(2), turns.restricts(3)
+    (True, True)
+    >>> TurnTable(banned=[(1, 2, 4)]).restricts(3)
+    False
+    """
+    def __init__(self, vertex_map=None, banned=(), left_turn=0, u_turn=0):
+        if left_turn < 0 or u_turn < 0:
+            # A negative turn cost would make A* heuristics overestimate
+            raise ValueError("turn costs must not be negative")
+
+        self.__vertex_map = vertex_map or {}
+        self.__positions = {}
+        self.__banned = {}
+        self.__count = 0
+        self.left_turn = left_turn
+        self.u_turn = u_turn
+        for u, v, w in banned:
+            self.ban(u, v, w)
+
+    def ban(self, u, v, w):
+        pairs = self.__banned.setdefault(v, set())
+        if (u, w) not in pairs:
+            pairs.add((u, w))
+            self.__count += 1
+
+    def is_banned(self, u, v, w):
+        pairs = self.__banned.get(v)
+        return pairs is not None and (u, w) in pairs
+
+    def restricts(self, v):
+        """
+        True if the cost of turning at v can depend on the edge a route
+        arrives by. Searches only need to tell arrivals apart at such
+        vertices; everywhere else every turn costs 0.
+        """
+        return bool(self.left_turn or self.u_turn) or v in self.__banned
+
+    def cost(self, u, v, w):
+        pairs = self.__banned.get(v)
+        if pairs is not None and (u, w) in pairs:
+            return INF
+        if u == w:
+            return self.u_turn
+        if self.left_turn and self.__is_left(u, v, w):
+            return self.left_turn
+        return 0
+
+    def __is_left(self, u, v, w):
+        points = [self.__position(x) for x in (u, v, w)]
+        if None in points:
+            return False
+        return is_left_turn(*points)
+
+    def __position(self, v):
+        # Every turn looks up three vertices, and each vertex takes part
+        # in many turns, so (lat, lon) is kept once looked up.
+        pos = self.__positions.get(v)
+        if pos is None:
+            data = self.__vertex_map.get(v)
+            if data is None:
+                return None
+            pos = self.__positions[v] = (data['lat'], data['lon'])
+        return pos
+
+    def __len__(self):
+        return self.__count
+
+def read_turn_restrictions(filename):
+    """
+    Banned turns from a file in the roads file's format, one
+    'T,from,via,to' line per turn; other lines are skipped.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile('w', suffix='.txt') as f:
+    ...     _ = f.write('V,1,53.5,-113.5\\nT,1,2,3\\nT, 4, 2, 1\\n')
+    ...     f.flush()
+    ...     read_turn_restrictions(f.name)
+    [(1, 2, 3), (4, 2, 1)]
+    """
+    restrictions = []
+    with open(filename, 'r') as f:
+        for line in f:
+            fields = [field.strip() for field in line.split(',')]
+            if fields[0].lower() == Restriction:
+                _, u, v, w, *rest = fields
+                restrictions.append((to_id(u), to_id(v), to_id(w)))
+
+    return restrictions
+
+if __name__ == '__main__':
+    doctest.testmod()
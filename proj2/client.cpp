@@ -47,7 +47,7 @@ void clear_status_msg();
 void handle_zoom_in();
 void handle_zoom_out();
 
-void draw_waypoint(char fallback_map_num, const LonLat32 wp);
+void receive_route(int path_len);
 void draw_cursor_converted(const char map_num, int32_t lon, int32_t lat);
 
 // global state variables
@@ -124,6 +124,12 @@ RequestState request_state = RS_WAIT_FOR_START;
 LonLat32 start = LonLat32(0,0);
 LonLat32 end = LonLat32(0,0);
 
+// Whether the last route came from a server sending routes by detail
+// level, and the most detailed map number it was sent for; zooming in
+// past that asks the server for more detail.
+uint8_t route_by_level = 0;
+uint8_t route_map_num = 0;
+
 #define __SERVER
 
 #ifndef __SERVER    
@@ -301,20 +307,18 @@ void loop() {
             Serial.println(path_len);
         #endif // DEBUG
 
-            if (path_len <= 0) {
+            if (path_len < 0) {
                 status_msg("path_len < 0");
-                debug_msg("path_len=0");
             } else {
-                comment_debug("retrieving waypoints");
-                for (int i = 0; i < path_len; ++i) {
-                    LonLat32 pt = get_waypoint();
-                    send_ack();
-                      
-                    draw_waypoint(current_map_num, pt);
-                } 
-
-                parse_eos();
-                status_msg("didn't catch messages");
+                // Reads the closing 'E' even when there is no route
+                receive_route(path_len);
+                if (path_len == 0) {
+                    debug_msg("path_len=0");
+                } else {
+                    route_by_level = srv_route_level >= 0;
+                    route_map_num = current_map_num;
+                    status_msg("didn't catch messages");
+                }
             }
             send_eos();
 
@@ -339,6 +343,14 @@ void loop() {
         draw_cursor();
 
         // Need to redraw any other things that are on the screen. Hint: Path
+        if (route_by_level && current_map_num > route_map_num) {
+            // Zoomed in: the coarse route sent so far misses detail
+            int path_len = srv_get_detail(current_map_num);
+            if (path_len >= 0)
+                receive_route(path_len);
+            send_eos();
+            route_map_num = current_map_num;
+        }
 
         // force a redisplay of status message
         clear_status_msg();
@@ -548,18 +560,21 @@ void blink(const uint8_t pin) {
     digitalWrite(pin, LOW);
 }
 
+void receive_route(int path_len) {
+    comment_debug("retrieving waypoints");
+    XY16 xy;
+    for (int i = 0; i < path_len; ++i) {
+        xy = get_waypoint_xy(current_map_num, xy);
+        send_ack();
+
+        draw_cursor_coords(xy.x, xy.y);
+    }
+
+    parse_eos();
+}
+
 void draw_cursor_converted(const char map_num, int32_t lon, int32_t lat) {
     int32_t x = longitude_to_x(map_num, lon);
     int32_t y = longitude_to_x(map_num, lat);
     draw_cursor_coords(x, y);
 }
-
-void draw_waypoint(char fallback_map_num, const LonLat32 wp) {
-    char mnum = wp.map_num;
-    if (mnum < 0)
-        mnum = fallback_map_num;
-
-    int32_t x = longitude_to_x(mnum, wp.lon);
-    int32_t y = longitude_to_x(mnum, wp.lat);
-    draw_cursor_coords(x, y);
-}
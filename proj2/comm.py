@@ -1,11 +1,20 @@
 #!/usr/bin/env python3
 
 import sys
+import argparse
+import threading
 
 # Local modules
-from proj1 import repl
+from proj1 import repl, hooks, session
+from proj1.request_queue import RequestQueue
+from proj1.server import create_server
+from proj1.stats import Stats, NULL_STATS
 from textserial import textserial
 
+# ISO-8859-1 maps every character to exactly one byte, so counting
+# characters on the text stream counts the bytes on the wire.
+SERIAL_ENCODING = 'ISO-8859-1'
+
 def default_port():
     if sys.platform == 'darwin':
         return '/dev/tty.usbmodem1411'
@@ -21,7 +30,8 @@ class SerialTalkie:
 
     def __start_talkie(self):
         self.__talkie = textserial.TextSerial(self.__port, self.__baud,
-                                                    encoding='ISO-8859-1')
+                                                    encoding=SERIAL_ENCODING,
+                                                    hooks=hooks)
                             
 
     def __enter__(self):
@@ -31,24 +41,154 @@ class SerialTalkie:
     def __exit__(self, *args, **kwargs):
         self.__talkie.__exit__(*args, **kwargs)
 
+class MeteredSerial:
+    """
+    Wraps a text stream, counting the bytes read and written through it.
+
+    >>> import io
+    >>> stats = Stats()
+    >>> f = MeteredSerial(io.StringIO('A\\n'), stats)
+    >>> f.readline()
+    'A\\n'
+    >>> f.write('W 1 2\\n')
+    6
+    >>> stats.snapshot()['counters'] == dict(serial_bytes_in=2,
+    ...     serial_lines_in=1, serial_bytes_out=6, serial_lines_out=1)
+    True
+    """
+    def __init__(self, stream, stats):
+        self.__stream = stream
+        self.__stats = stats
+
+    def readline(self):
+        line = self.__stream.readline()
+        if line:
+            # Nothing came before the timeout otherwise
+            self.__stats.incr('serial_bytes_in', len(line))
+            self.__stats.incr('serial_lines_in')
+        return line
+
+    def close(self):
+        return self.__stream.close()
+
+    def pending_lines(self):
+        return self.__stream.pending_lines()
+
+    @property
+    def eof(self):
+        return getattr(self.__stream, 'eof', False)
+
+    def write(self, content):
+        self.__stats.incr('serial_bytes_out', len(content))
+        self.__stats.incr('serial_lines_out')
+        return self.__stream.write(content)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+                description='Serve routes to the Arduino client.')
+    parser.add_argument('-s', '--serial', dest='ports', action='append',
+                        metavar='PORT',
+                        help='path to serial port (default: %s); repeat to'
+                             ' serve several clients from one server'%(
+                                                        default_port()))
+    parser.add_argument('--workers', type=int, default=1, metavar='N',
+                        help='with several ports, compute at most N routes'
+                             ' at once (default: %(default)s)')
+    parser.add_argument('--stats', type=float, default=None,
+                        metavar='SECONDS',
+                        help='log request timings every SECONDS seconds')
+    parser.add_argument('--coords', default=None, metavar='PATH',
+                        help='serve vertex coordinates from this memory-mapped'
+                             ' file, shared by every comm.py process')
+    parser.add_argument('--graph', default=None, metavar='PATH',
+                        help='serve the whole road graph and its edge costs'
+                             ' from this memory-mapped file, shared by every'
+                             ' comm.py process')
+    parser.add_argument('--load-workers', type=int, default=None,
+                        metavar='N',
+                        help='parse the roads file in N processes'
+                             ' (0: one per core)')
+    parser.add_argument('--fixed-point', type=int, default=None,
+                        metavar='SCALE',
+                        help='use integer edge costs in 1/SCALE units of'
+                             ' the metric, rounded once at startup')
+    parser.add_argument('--turn-restrictions', default=None, metavar='PATH',
+                        help='never route through the turns listed in this'
+                             ' file, one T,from,via,to line each')
+    parser.add_argument('--left-turn-cost', type=float, default=0,
+                        metavar='COST',
+                        help='add COST, in edge cost units, to every left'
+                             ' turn')
+    parser.add_argument('--segments', action='store_true',
+                        help='snap requests to the nearest road segment'
+                             ' instead of the nearest vertex')
+    parser.add_argument('--pixels', action='store_true',
+                        help='send waypoints as pixel steps on the map tile'
+                             ' named in the request')
+    parser.add_argument('--timeout', type=float, default=5.0,
+                        metavar='SECONDS',
+                        help='give up on a client line after SECONDS'
+                             ' (default: %(default)s)')
+    parser.add_argument('--levels', action='store_true',
+                        help='send routes only in the detail the client\'s'
+                             ' map shows, refining them as it zooms in')
+
+    args = parser.parse_args()
+    if args.segments and (args.turn_restrictions is not None or
+                          args.left_turn_cost):
+        # Routes between snapped points do not apply turns
+        parser.error('--segments cannot be combined with --turn-restrictions'
+                     ' or --left-turn-cost')
+    return args
+
+def serve_port(port, srv, vmap, args, stats, queue=None):
+    with SerialTalkie(port) as f:
+        # Lines are read straight off the port's descriptor, waiting at
+        # most args.timeout for each, while replies are written through f.
+        reader = session.LineReader(f.ser_in.fileno(), timeout=args.timeout,
+                                    encoding=SERIAL_ENCODING)
+        writer = f
+        if stats.enabled:
+            reader = MeteredSerial(reader, stats)
+            writer = MeteredSerial(writer, stats)
+        rpl = repl.Repl(srv, vmap, stdin=reader, stdout=writer, stats=stats,
+                        pixels=args.pixels, levels=args.levels, queue=queue)
+        try:
+            session.serve(rpl)
+        finally:
+            reader.close()
+
 def main():
-    
-    with SerialTalkie() as f:
-        rpl = repl.fresh_repl(f, f)
-        # First step is to wait for the start of the session
-        while 1:
-            head, *rest = rpl.read_evaluate()
-            if rpl.bos(head):
-                break
-
-            print('Started!')
-            evaluating = True
-
-            while evaluating:
-                head, *rest = rpl.read_evaluate()
-                # print(head, rest)
-                if rpl.eos(head):
-                    evaluating = False
+    args = parse_args()
+    stats = NULL_STATS
+    if args.stats is not None:
+        stats = Stats(log_every=args.stats)
+
+    srv, vmap = create_server(stats=stats, coords_path=args.coords,
+                              graph_path=args.graph,
+                              load_workers=args.load_workers,
+                              fixed_point=args.fixed_point,
+                              turn_restrictions=args.turn_restrictions,
+                              left_turn=args.left_turn_cost,
+                              segments=args.segments)
+
+    ports = args.ports or [default_port()]
+    if len(ports) == 1:
+        serve_port(ports[0], srv, vmap, args, stats)
+        return
+
+    # Every client shares the one server. The queue runs at most
+    # args.workers searches at once, drops requests a client has already
+    # replaced, computes identical ones once and turns requests away
+    # when too many are waiting.
+    queue = RequestQueue(workers=args.workers, stats=stats)
+    threads = [threading.Thread(target=serve_port, name=port,
+                                args=(port, srv, vmap, args, stats, queue))
+                    for port in ports]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
 
 if __name__ == '__main__':
     try:
@@ -1,10 +1,13 @@
 #include "serial_handling.h"
+#include "map.h"
 
 #include <Arduino.h>
 #include <errno.h>
 #include <assert13.h>
 #include <stdio.h> // isdigit
 
+int8_t srv_route_level = -1;
+
 // replace the next two functions with your implementation
 // of the communication with the server
 int srv_get_pathlen(LonLat32 start, LonLat32 end) {
@@ -22,8 +25,14 @@ int srv_get_pathlen(LonLat32 start, LonLat32 end) {
 #endif // DEBUG
 
     int32_t v = 0;
+    int16_t end_index;
     
-    while (parse_first_digits(msg, count_len, &v) < 0);
+    while ((end_index = parse_first_digits(msg, count_len, &v)) < 0);
+
+    // 'N count level' from a server sending routes by detail level
+    char *rest;
+    long level = strtol(msg + end_index, &rest, 10);
+    srv_route_level = rest == msg + end_index ? -1 : (int8_t) level;
 
     comment_debug_ln("FLUX ");
     comment_debug_ln(v, DEC);
@@ -33,6 +42,21 @@ int srv_get_pathlen(LonLat32 start, LonLat32 end) {
     return v;
 }
 
+int srv_get_detail(char map_num) {
+    Serial.print("L ");
+    Serial.println((int) map_num);
+    Serial.flush();
+
+    uint16_t count_len = 100;
+    char msg[count_len];
+    serial_readline(msg, count_len);
+
+    int32_t v = 0;
+    if (parse_first_digits(msg, count_len, &v) < 0)
+        return -1;
+    return v;
+}
+
 bool int10Part(const char c) {
     return c == '-' || c == '+' || isdigit(c);
 }
@@ -94,6 +118,27 @@ LonLat32 get_waypoint() {
     return LonLat32(lat, lon);
 }
 
+XY16 get_waypoint_xy(char map_num, const XY16 prev) {
+    int32_t a = 0, b = 0;
+    int16_t index;
+    uint16_t nchars = 40;
+    char line[nchars];
+
+    serial_readline(line, nchars);
+    index = parse_first_digits(line, nchars, &a);
+    if (index >= 0)
+        parse_first_digits(line + index, nchars - index, &b);
+
+    switch (line[0]) {
+    case 'P': // Pixel position already projected by the server
+        return XY16(a, b);
+    case 'D': // Step from the previous waypoint
+        return XY16(prev.x + a, prev.y + b);
+    default:  // 'W lat lon', project it here
+        return XY16(longitude_to_x(map_num, b), latitude_to_y(map_num, a));
+    }
+}
+
 void debug_waypoint(const LonLat32 pt) {
     comment_debug_ln(pt.lon);
     comment_debug_ln(pt.lat);
@@ -218,6 +263,11 @@ void send_coords(const LonLat32 *start, const LonLat32 *end) {
     Serial.print(end->lat);
     Serial.print(" ");
     Serial.print(end->lon);
+    if (start->map_num >= 0) {
+        // Lets the server answer with pixels on this map tile
+        Serial.print(" ");
+        Serial.print((int) start->map_num);
+    }
     Serial.println();
     Serial.flush();
 }
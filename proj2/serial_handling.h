@@ -23,12 +23,24 @@
   */
 int srv_get_pathlen(LonLat32 start, LonLat32 end);
 
+/** The detail level (map number) the last route was sent at, or -1 if
+    the server does not send routes by level and so cannot answer
+    srv_get_detail. Set by srv_get_pathlen.
+  */
+extern int8_t srv_route_level;
+
 /** Gets the waypoints on the path from start to end
     corresponding to a previously requested path.
     This function can be called only once after every call
     to srv_get_pathlen, which iniates the request.
   */
 int srv_get_waypoints(LonLat32* waypoints, int path_len);
+
+/** Asks the server to resend the last route with the detail needed on
+    map map_num and returns its number of waypoints, which are then read
+    as after srv_get_pathlen.
+  */
+int srv_get_detail(char map_num);
 // <<<<<<<<<<<<<<<<<<<< CUT <<<<<<<<<<<<<<<<<<<< 
 
 
@@ -105,6 +117,12 @@ void send_coords(const LonLat32 *start, const LonLat32 *end);
 int16_t parse_first_digits(const char *str, const uint16_t len, int32_t *sav);
 
 LonLat32 get_waypoint();
+
+/** Reads the next waypoint as a pixel position on map map_num: 'P x y'
+    and 'D dx dy' (a step from prev) lines are used as they are, and
+    'W lat lon' lines are projected here.
+  */
+XY16 get_waypoint_xy(char map_num, const XY16 prev);
 void debug_waypoint(const LonLat32 pt);
 
 #endif
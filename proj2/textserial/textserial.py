@@ -47,6 +47,12 @@ class TextSerial(io.TextIOWrapper):
                 for both input and output. This will work properly
                 only with some serial objects, such as the loop back object.
                 This is meant mainly for testing purposes.
+            hooks: Optional profiling hooks, any object with a
+                span(region, **info) context manager such as proj1.hooks.
+                write runs inside a 'serial.write' span. Reads are not
+                wrapped: comm.py reads the port through proj1's
+                session.LineReader, whose 'serial.read' span covers them.
+                Defaults to None, no hooks.
             
         '''
         # We initialize two Serial objects; one for the input, another
@@ -76,6 +82,7 @@ class TextSerial(io.TextIOWrapper):
         newline        = getkwarg('newline',None,kwargs)
         line_buffering = getkwarg('line_buffering',True,kwargs)
         write_through  = getkwarg('write_through',False,kwargs)
+        self.hooks     = getkwarg('hooks',None,kwargs)
         
         # get timeout
         timeout = kwargs.get('timeout',0)
@@ -132,6 +139,12 @@ class TextSerial(io.TextIOWrapper):
         # until the timeout expires! This totally defeats the purpose of
         # timeouts (again).
         self._CHUNK_SIZE = 1
+    def write(self, s):
+        '''Writes s, inside a 'serial.write' span if hooks are set'''
+        if self.hooks is None:
+            return super().write(s)
+        with self.hooks.span('serial.write', port=self.ser_out.port):
+            return super().write(s)
     def setTimeout(self,timeout):
         '''Sets the timeout for reading'''
         self.ser_in.setTimeout(timeout)